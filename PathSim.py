@@ -22,21 +22,74 @@
 # *                                                                         *
 # ***************************************************************************
 
-import math
 import time
-import importlib
+import threading
 
 from PySide import QtCore, QtGui
 
 import FreeCAD
-import Mesh
 
 import engines
+import PathSimCore
+
+class Coalescer(QtCore.QObject):
+	''' hands the latest updates from the simulation thread to the gui thread at a bounded rate
+
+	an update posted while an earlier one of the same kind is waiting replaces it, mesh
+	patches are merged instead. dropped counts the updates replaced before delivery.
+	'''
+
+	posted = QtCore.Signal()
+
+	def __init__(self, deliver, interval=1.0 / 30.0):
+		QtCore.QObject.__init__(self)
+		self.deliver = deliver  # called in the gui thread with a dict of kind: latest value
+		self.interval = interval  # shortest time between deliveries in seconds
+		self.lock = threading.Lock()
+		self.latest = {}
+		self.waiting = False
+		self.dropped = 0
+		self.lastDelivery = 0.0
+		self.posted.connect(self.schedule, QtCore.Qt.QueuedConnection)
+
+	def post(self, kind, value):
+		''' queue value for delivery, called from any thread '''
+		with self.lock:
+			if kind in self.latest:
+				self.dropped += 1
+				if kind == "patches":
+					merged = self.latest[kind]
+					merged.update(value)
+					value = merged
+			self.latest[kind] = value
+			if self.waiting:
+				return
+			self.waiting = True
+		self.posted.emit()
+
+	def schedule(self):
+		''' deliver now or once the interval since the last delivery has passed '''
+		wait = self.lastDelivery + self.interval - time.perf_counter()
+		if wait > 0:
+			QtCore.QTimer.singleShot(int(wait * 1000) + 1, self.flush)
+		else:
+			self.flush()
+
+	def flush(self):
+		with self.lock:
+			latest = self.latest
+			self.latest = {}
+			self.waiting = False
+		self.lastDelivery = time.perf_counter()
+		if latest:
+			self.deliver(latest)
+
 
 class PathSim (QtCore.QThread):
 
 	updatePos = QtCore.Signal(FreeCAD.Placement)
-	updateMesh = QtCore.Signal(Mesh.Mesh)
+	updateMesh = QtCore.Signal(object)  # (vertices, faces) arrays
+	updatePatches = QtCore.Signal(object)
 	complete = QtCore.Signal()
 	progress = QtCore.Signal(float)
 	cleanup = QtCore.Signal()
@@ -44,194 +97,103 @@ class PathSim (QtCore.QThread):
 
 	def __init__(self):
 		QtCore.QThread.__init__(self)
-		self.operations = []
-		self.stepDistance = 2
-		# self.skippedDistance = 0
-		self.running = False
-		self.idx = 0  # index of current position
-		self.engine = None
+		self.simulation = PathSimCore.Simulation()
+		self.simulation.setSpeed(1.0)
+		# poses, progress and meshes are coalesced so a fast engine can't flood the gui
+		self.coalescer = Coalescer(self.deliver)
+		self.simulation.onPosition = lambda placement: self.coalescer.post("pose", placement)
+		self.simulation.onMesh = lambda mesh: self.coalescer.post("mesh", mesh)
+		self.simulation.onPatches = lambda patches: self.coalescer.post("patches", patches)
+		self.simulation.onProgress = lambda progress: self.coalescer.post("progress", progress)
+		self.simulation.onOperation = self.changedOp.emit
+
+	@property
+	def droppedUpdates(self):
+		''' number of pose, progress and mesh updates replaced by newer ones before the gui showed them '''
+		return self.coalescer.dropped
+
+	def deliver(self, latest):
+		''' emit the coalesced updates, called in the gui thread '''
+		if "mesh" in latest:
+			self.updateMesh.emit(latest["mesh"])
+		if "patches" in latest:
+			self.updatePatches.emit(latest["patches"])
+		if "pose" in latest:
+			self.updatePos.emit(latest["pose"])
+		if "progress" in latest:
+			self.progress.emit(latest["progress"])
+
+	@property
+	def stepDistance(self):
+		return self.simulation.stepDistance
+
+	@property
+	def engine(self):
+		return self.simulation.engine
 
 	def setupEngine(self, engine):
-		# from engines import nativeEngine
-		print("PathSim: Setup Engine:", engine)
-		importstring = "engines.{}".format(engine)
-
 		try:
 			# try to load the selected engine
-			engineModule = importlib.import_module(importstring)
-			eng = engineModule.Engine()
-			self.engine = eng
+			self.simulation.setEngine(PathSimCore.loadEngine(engine))
 		except:
 			self.cleanup.emit()
 			msgBox = QtGui.QMessageBox()
-			msgBox.setText("An error occoured while importing {}".format(importstring))
+			msgBox.setText("An error occoured while importing engines.{}".format(engine))
 			msgBox.exec_()
 
-	def setOperations(self, operations):
-		self.operations = operations
+	def setJob(self, job):
+		self.simulation.setJob(job)
 
-	def stop(self):
-		self.running = False
+	def setOperations(self, operations, settings=None):
+		''' set the operations to simulate. settings optionally maps operation names to PathSimPath.SampleSettings '''
+		self.simulation.setOperations(operations, settings)
 
-	def run(self):
+	def setStepDistance(self, stepDistance):
+		self.simulation.setStepDistance(stepDistance)
 
-		if self.engine is None:
-			print("engine not set")
-			return
+	def setSpeed(self, speed):
+		''' set the playback speed multiplier, 0 runs as fast as the engine allows '''
+		self.simulation.setSpeed(speed)
 
-		self.idx = 0  # reset the progress to 0
-		self.running = True
-		job = FreeCAD.ActiveDocument.findObjects("Path::FeaturePython", "Job.*")[0]
-		stock = job.Stock
-		self.engine.setStock(stock.Shape)
-		## Expand the path
-		self.pathPoints = self.discretizePath()
-		rot = FreeCAD.Rotation(FreeCAD.Vector(0, 0, 1), 0)
-		op = ""
+	def stop(self):
+		self.simulation.stop()
 
-		while self.idx < len(self.pathPoints):
+	def close(self):
+		''' stop the simulation and release the expanded path '''
+		self.simulation.stop(refresh=False)
+		self.wait()
+		self.simulation.close()
 
-			if not self.running:
+	def run(self):
+		self.coalescer.dropped = 0
+		try:
+			if not self.simulation.run():
 				print("QUITING THREAD")
-				self.quit()
-				break
-
-			pntData = self.pathPoints[self.idx]
-			pos = pntData[0]
-			opLabel = pntData[1]
-
-			if op != opLabel:
-				print("Load Tool for op:", opLabel)
-				op = opLabel
-				operation = FreeCAD.ActiveDocument.getObject(op)
-				tool = operation.ToolController.Tool
-				self.engine.setTool(tool.Shape)
-				self.changedOp.emit(operation)
-			
-			self.updateToolPosition(pos, rot)
-			self.engine.processPosition(FreeCAD.Placement(pos, rot))
-
-			if self.idx % 5 == 0:  # update the next every x iterations
-				mesh = self.engine.getMesh()
-				self.updateMesh.emit(mesh)
-
-			self.progress.emit(self.idx / len(self.pathPoints))
-			self.idx += 1
-
+		except Exception as e:
+			# the simulation has stopped its threads, remove what it was showing
+			print("PathSim: simulation failed:", e)
+			self.cleanup.emit()
+		print("PathSim: {} gui updates coalesced".format(self.coalescer.dropped))
 		# emit complete signal
 		self.complete.emit()
-	
+
+	def refreshMesh(self):
+		''' show the stock at full resolution, the simulation must not be running '''
+		if not self.isRunning():
+			self.simulation.refreshMesh()
+
 	def skipTo(self, progress):
 		''' skip the the selected point: progress is a percentage where 1 = 100% '''
-		self.idx = int(progress * len(self.pathPoints))
-		# print("PathSim.Jump: new pos", self.idx, "of", len(self.pathPoints))
-
-	def updateToolPosition(self, pos, rot):
-		self.updatePos.emit(FreeCAD.Placement(pos, rot))
-		time.sleep(0.05)
-
-	def discretizePath(self):
-		''' split the path in to discrete points'''
-		pathPoints = []
-		currentPos = FreeCAD.Vector(0, 0, 0)
-		pos = FreeCAD.Vector(0, 0, 0)
-		centrePos = FreeCAD.Vector()
-		
-		for op in self.operations:
-			for command in op.Path.Commands:
-				name = command.Name
-
-				centrePos.x = currentPos.x
-				centrePos.y = currentPos.y
-				centrePos.z = currentPos.z
-
-				if name in ["G0", "G00", "G1", "G01", "G2", "G02","G3", "G03"]:
-					parameters = command.Parameters
-					for param in parameters:
-						if param == 'X':
-							pos.x = parameters['X']
-						if param == 'Y':
-							pos.y = parameters['Y']
-						if param == 'Z':
-							pos.z = parameters['Z']
-						if param == 'I':
-							i = parameters['I']  # x offset to centre
-							centrePos.x += i
-						if param == 'J':
-							j = parameters['J']  # y offset to centre
-							centrePos.y += j
-
-					if name in ["G2", "G02", "G3", "G03"]:
-						radius = round(centrePos.sub(currentPos).Length, 2)
-
-						aX = currentPos.x - centrePos.x
-						aY = currentPos.y - centrePos.y
-						bX = pos.x - centrePos.x
-						bY = pos.y - centrePos.y
-
-						startAng = math.atan2(aY, aX) 
-						# endAng = math.atan2(bY, bX)
-						totalAng = math.atan2(aX * bY - aY * bX, aX * bX + aY * bY)
-
-						if round(totalAng, 2) == 0.0:
-							totalAng = math.pi * 2
-
-						if name in ["G2", "G02"]:
-							totalAng = -abs(totalAng)		
-						
-						if name in ["G3", "G03"]:
-							totalAng = abs(totalAng)
-
-						arcLen = abs(totalAng) * radius
-						segments = math.ceil(arcLen / self.stepDistance)
-						stepAng = totalAng / segments
-						stepZ = (pos.z - currentPos.z) / segments
-
-						#print("Final Angles: start", startAng, " end: ", endAng, "total: ", totalAng, " segments: ", segments)
-
-						for seg in range(segments):
-							angle = startAng + seg * stepAng
-							segX = centrePos.x + math.cos(angle) * radius
-							segY = centrePos.y + math.sin(angle) * radius
-							segZ = currentPos.z + stepZ * seg
-							pathPoints.append([FreeCAD.Vector(segX, segY, segZ), op.Label])
-							
-
-						currentPos.x = pos.x
-						currentPos.y = pos.y
-						currentPos.z = pos.z
-
-						### END OF ARC ###
-
-
-					if name in ["G0", "G00", "G1", "G01"]:
-						distance = currentPos.distanceToPoint(pos)
-						# distance = self.calculateDistance(currentPos, pos)
-						# print("pos", pos)
-						# print("distance", distance, "skippedDistance", self.skippedDistance)
-
-						'''
-						if distance < self.stepDistance:
-							# update the cutsim 
-							# dont move the tool
-							self.skippedDistance += distance
-						'''
-
-						if distance >= self.stepDistance:  # or self.skippedDistance >= self.stepDistance:
-							# calculate the position for the stepDistance
-							# update the cutsim
-							# update the tool position
-							normal = pos.sub(currentPos).normalize()
-							# print("normal:", normal, "pos", pos)
-							_stepDistance = normal * self.stepDistance
-							steps = int(distance / self.stepDistance)
-
-							for i in range(steps):
-								# print("step ", i, "of", steps, "POS:", pos)
-								pos = currentPos.add(_stepDistance)
-								pathPoints.append([FreeCAD.Vector(pos.x, pos.y, pos.z), op.Label])
-								currentPos.x = pos.x
-								currentPos.y = pos.y
-								currentPos.z = pos.z
-								#self.skippedDistance = 0
-		return pathPoints
\ No newline at end of file
+		if self.isRunning():
+			self.simulation.skipTo(progress)
+		else:
+			self.scrubTo(progress)
+
+	def scrubTo(self, progress):
+		''' show the stock captured at progress once the simulation has finished, no engine work is done '''
+		if self.isRunning() or not self.simulation.frames.complete:
+			return
+		arrays = self.simulation.frameAt(progress)
+		if arrays is not None:
+			self.updateMesh.emit(arrays)
+			self.progress.emit(progress)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+''' headless simulation with no gui, run at full engine speed
+
+from python:
+	import PathSimBatch
+	summary = PathSimBatch.simulate("part.FCStd", job="Job", engine="libcutsim_engine", meshFile="stock.stl")
+
+from the command line, freecadcmd handles every argument itself unless they follow --pass:
+	freecadcmd PathSimBatch.py --pass part.FCStd --job Job --engine libcutsim_engine --mesh stock.stl --summary timing.json
+
+or with a python that can import FreeCAD, by putting the FreeCAD lib directory on PYTHONPATH:
+	PYTHONPATH=/usr/lib/freecad/lib python3 PathSimBatch.py part.FCStd --job Job --engine libcutsim_engine
+'''
+
+import os
+import sys
+import json
+import argparse
+
+# make the addon modules importable when run as a script
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+if __dir__ not in sys.path:
+	sys.path.append(__dir__)
+
+import FreeCAD
+
+import PathSimCache
+import PathSimCore
+
+
+def getOperations(job, names=None):
+	''' return the active operations of job, optionally only those whose name or label is in names '''
+	operations = []
+	for op in job.Operations.OutList:
+		if not getattr(op, 'Active', True):
+			continue
+		if names and op.Name not in names and op.Label not in names:
+			continue
+		operations.append(op)
+	return operations
+
+
+def simulate(document, job=None, operations=None, engine="move_only_engine", stepDistance=2, settings=None, meshFile=None, summaryFile=None,
+		saveTessellations=False):
+	''' simulate the job in document and return a timing summary dict
+
+	document is a FreeCAD document or a path to one, job the name or label of the job (the first
+	job is used by default), operations a list of operation names or labels (all active by default).
+	the final stock mesh is written to meshFile and the summary to summaryFile as json when given.
+	shape tessellations are kept next to the document when saveTessellations is set.
+	'''
+	if isinstance(document, str):
+		document = FreeCAD.openDocument(document)
+	PathSimCache.setCacheDir(PathSimCache.documentCacheDir(document), saveTessellations)
+
+	if job is None:
+		jobObj = PathSimCore.findJob(document)
+	else:
+		jobObj = document.getObject(job)
+		if jobObj is None:
+			matches = document.getObjectsByLabel(job)
+			jobObj = matches[0] if matches else None
+
+	if jobObj is None:
+		raise ValueError("No job found in document: {}".format(document.Name))
+
+	ops = getOperations(jobObj, operations)
+	if not ops:
+		raise ValueError("No active operations found in job: {}".format(jobObj.Label))
+
+	sim = PathSimCore.Simulation()
+	# a batch run never seeks, so no engine checkpoints are kept
+	sim.seekable = False
+	sim.setEngine(PathSimCore.loadEngine(engine))
+	sim.setJob(jobObj)
+	sim.setStepDistance(stepDistance)
+	sim.setOperations(ops, settings)
+	sim.run()
+
+	summary = dict(sim.timings)
+	summary["job"] = jobObj.Label
+	summary["operations"] = [op.Label for op in ops]
+	summary["engine"] = engine
+	summary["positionsPerSecond"] = summary["positions"] / max(summary["total"], 1e-9)
+	if getattr(sim.engine, "report", None):
+		summary["engineReport"] = sim.engine.report
+
+	if meshFile:
+		mesh = sim.engine.getMesh()
+		mesh.write(meshFile)
+	sim.close()
+
+	if summaryFile:
+		with open(summaryFile, "w") as f:
+			json.dump(summary, f, indent=2)
+
+	return summary
+
+
+def scriptArgs(argv):
+	''' return the arguments for this script, those after --pass when run by freecadcmd '''
+	if "--pass" in argv:
+		return argv[argv.index("--pass") + 1:]
+	for idx, arg in enumerate(argv):
+		if os.path.basename(arg) == os.path.basename(__file__):
+			return argv[idx + 1:]
+	return argv[1:]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="PathSimBatch", description="Headless FreeCAD path simulation")
+	parser.add_argument("document", help="FreeCAD document to simulate")
+	parser.add_argument("--job", help="name or label of the job, the first job by default")
+	parser.add_argument("--op", action="append", dest="operations", help="operation name or label, may be repeated")
+	parser.add_argument("--engine", default="move_only_engine", help="engine module from the engines directory")
+	parser.add_argument("--step", type=float, default=2, help="path step distance")
+	parser.add_argument("--mesh", help="file to write the final stock mesh to")
+	parser.add_argument("--summary", help="file to write the timing summary to as json")
+	parser.add_argument("--save-tessellations", action="store_true", help="keep shape tessellations next to the document")
+	args = parser.parse_args(scriptArgs(sys.argv) if argv is None else argv)
+
+	summary = simulate(args.document, args.job, args.operations, args.engine, args.step,
+		meshFile=args.mesh, summaryFile=args.summary, saveTessellations=args.save_tessellations)
+
+	for key, value in summary.items():
+		print("{}: {}".format(key, value))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import io
+import os
+import bisect
+import shutil
+import hashlib
+import tempfile
+import collections
+
+import numpy as np
+
+
+class LRUCache:
+	''' least recently used cache bounded by the total size of its entries in bytes '''
+
+	def __init__(self, maxBytes, onEvict=None):
+		self.maxBytes = maxBytes
+		self.size = 0
+		self.entries = collections.OrderedDict()  # key: (value, size)
+		self.onEvict = onEvict  # called with (key, value) for entries evicted to make room
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key, default=None):
+		entry = self.entries.get(key)
+		if entry is None:
+			return default
+		self.entries.move_to_end(key)
+		return entry[0]
+
+	def put(self, key, value, size):
+		''' add value to the cache, evicting the least recently used entries to stay within maxBytes '''
+		if key in self.entries:
+			self.size -= self.entries.pop(key)[1]
+		if size > self.maxBytes:
+			if self.onEvict:
+				self.onEvict(key, value)
+			return
+		self.entries[key] = (value, size)
+		self.size += size
+		while self.size > self.maxBytes:
+			evictedKey, (evicted, evictedSize) = self.entries.popitem(last=False)
+			self.size -= evictedSize
+			if self.onEvict:
+				self.onEvict(evictedKey, evicted)
+
+	def clear(self):
+		self.entries.clear()
+		self.size = 0
+
+
+def documentCacheDir(doc):
+	''' return the cache directory kept next to a saved document, or None if the document isn't saved '''
+	fileName = getattr(doc, 'FileName', '')
+	if not fileName:
+		return None
+	return os.path.splitext(fileName)[0] + ".pathsim"
+
+
+def shapeHash(shape):
+	''' hash of the shape geometry and placement '''
+	return hashlib.sha1(shape.exportBrepToString().encode()).hexdigest()
+
+
+def trimDir(cacheDir, prefix, maxBytes):
+	''' remove the least recently used files starting with prefix beyond maxBytes '''
+	try:
+		files = [os.path.join(cacheDir, f) for f in os.listdir(cacheDir) if f.startswith(prefix)]
+		stats = sorted(((os.path.getmtime(f), os.path.getsize(f), f) for f in files), reverse=True)
+	except OSError:
+		return
+
+	total = 0
+	for _, size, f in stats:
+		total += size
+		if total > maxBytes:
+			try:
+				os.remove(f)
+			except OSError:
+				pass
+
+
+def tessellateShape(shape, tolerance=0.1):
+	''' tessellate a freecad shape without caching, returns read only (vertices, faces) arrays '''
+	points, facets = shape.tessellate(tolerance)
+	vertices = np.array([(p.x, p.y, p.z) for p in points], dtype=np.float64).reshape(-1, 3)
+	faces = np.array(facets, dtype=np.int64).reshape(-1, 3)
+	for array in (vertices, faces):
+		array.setflags(write=False)
+	return vertices, faces
+
+
+class TessellationCache:
+	''' cache of shape tessellations as (vertices, faces) arrays, shared by the panel and the engines
+
+	entries are keyed by a hash of the shape geometry and the tolerance. with a cache directory
+	set, tessellations are also kept on disk, the least recently used files are removed once the
+	directory grows beyond maxDiskBytes.
+	'''
+
+	def __init__(self, maxBytes=256 * 1024 * 1024, maxDiskBytes=512 * 1024 * 1024):
+		self.memory = LRUCache(maxBytes)
+		self.maxDiskBytes = maxDiskBytes
+		# shape hashCode: (shape, geometry hash). the shape is held so its hashCode can't be reused
+		# by another shape while the entry exists, and compared with isSame in case it is
+		self.contentKeys = LRUCache(256)
+		self.cacheDir = None
+
+	def setCacheDir(self, cacheDir):
+		self.cacheDir = cacheDir
+
+	def key(self, shape, tolerance):
+		''' return the cache key for shape, hashing the geometry only once per shape instance '''
+		identity = shape.hashCode()
+		entry = self.contentKeys.get(identity)
+		if entry is None or not entry[0].isSame(shape):
+			entry = (shape, shapeHash(shape))
+			self.contentKeys.put(identity, entry, 1)
+		return ("shape", entry[1], tolerance)
+
+	def diskPath(self, key):
+		if self.cacheDir is None:
+			return None
+		return os.path.join(self.cacheDir, "tess_{}_{}.npz".format(key[1], repr(key[2])))
+
+	def tessellate(self, shape, tolerance=0.1):
+		''' return read only (vertices, faces) arrays for shape '''
+		key = self.key(shape, tolerance)
+		arrays = self.memory.get(key)
+		if arrays is not None:
+			return arrays
+
+		arrays = None
+
+		path = self.diskPath(key)
+		if path is not None and os.path.exists(path):
+			try:
+				with np.load(path) as data:
+					arrays = (data["vertices"], data["faces"])
+				# mark as recently used for the size limit
+				os.utime(path)
+			except (OSError, ValueError, KeyError):
+				arrays = None
+
+		if arrays is None:
+			arrays = tessellateShape(shape, tolerance)
+			if path is not None:
+				self.save(path, *arrays)
+		else:
+			for array in arrays:
+				array.setflags(write=False)
+
+		self.memory.put(key, arrays, arrays[0].nbytes + arrays[1].nbytes)
+		return arrays
+
+	def save(self, path, vertices, faces):
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			np.savez(path, vertices=vertices, faces=faces)
+		except OSError as e:
+			print("PathSimCache: unable to save tessellation:", e)
+			return
+		trimDir(self.cacheDir, "tess_", self.maxDiskBytes)
+
+	def clear(self):
+		self.memory.clear()
+		self.contentKeys.clear()
+
+
+# shared by every op, run and engine in the session
+tessellationCache = TessellationCache()
+
+
+class PathCache:
+	''' cache of parsed operation paths, keyed by a hash of the gcode and the start position
+
+	entries hold the moves arrays (starts, ends, centres, types, endPos) from PathSimPath.parseMoves.
+	with a cache directory set they are kept on disk as .npz files, the least recently used
+	files are removed once the directory grows beyond maxDiskBytes.
+	'''
+
+	def __init__(self, maxBytes=64 * 1024 * 1024, maxDiskBytes=512 * 1024 * 1024):
+		self.memory = LRUCache(maxBytes)
+		self.maxDiskBytes = maxDiskBytes
+		self.cacheDir = None
+
+	def setCacheDir(self, cacheDir):
+		self.cacheDir = cacheDir
+
+	def key(self, path, startPos):
+		''' return the key for a Path.Path starting at startPos '''
+		content = path.toGCode() + repr(tuple(float(v) for v in startPos))
+		return hashlib.sha1(content.encode()).hexdigest()
+
+	def diskPath(self, key):
+		if self.cacheDir is None:
+			return None
+		return os.path.join(self.cacheDir, "path_{}.npz".format(key))
+
+	def get(self, key):
+		''' return the cached moves for key or None '''
+		moves = self.memory.get(key)
+		if moves is not None:
+			return moves
+
+		path = self.diskPath(key)
+		if path is None or not os.path.exists(path):
+			return None
+
+		try:
+			with np.load(path) as data:
+				moves = (data["starts"], data["ends"], data["centres"], data["types"], tuple(data["endPos"]))
+			# mark as recently used for the size limit
+			os.utime(path)
+		except (OSError, ValueError, KeyError):
+			return None
+
+		self.memory.put(key, moves, movesSize(moves))
+		return moves
+
+	def put(self, key, moves):
+		self.memory.put(key, moves, movesSize(moves))
+		path = self.diskPath(key)
+		if path is None:
+			return
+
+		starts, ends, centres, types, endPos = moves
+		try:
+			os.makedirs(self.cacheDir, exist_ok=True)
+			np.savez(path, starts=starts, ends=ends, centres=centres, types=types, endPos=np.array(endPos))
+		except OSError as e:
+			print("PathSimCache: unable to save path:", e)
+			return
+		self.trimDisk()
+
+	def trimDisk(self):
+		''' remove the least recently used path files beyond maxDiskBytes '''
+		trimDir(self.cacheDir, "path_", self.maxDiskBytes)
+
+	def clear(self):
+		self.memory.clear()
+
+
+def movesSize(moves):
+	return sum(array.nbytes for array in moves[:4])
+
+
+# shared by every run in the session
+pathCache = PathCache()
+
+
+class FrameCache:
+	''' compressed stock meshes captured at keyframes during a run, for scrubbing without re-simulating
+
+	a keyframe is kept every interval of progress. the compressed meshes are held in memory up
+	to maxBytes, with spill set the least recently used frames move to a temporary directory
+	instead of being dropped.
+	'''
+
+	def __init__(self, interval=0.01, maxBytes=256 * 1024 * 1024, spill=True):
+		self.interval = interval
+		self.spill = spill
+		self.spillDir = None
+		self.memory = LRUCache(maxBytes, self.evict)
+		self.keys = []  # progress of each keyframe, sorted
+		self.complete = False  # True once the run has finished and every frame was captured
+
+	def __len__(self):
+		return len(self.keys)
+
+	def due(self, progress):
+		''' return True if a keyframe should be captured at progress '''
+		return not self.keys or progress - self.keys[-1] >= self.interval
+
+	def add(self, progress, vertices, faces):
+		''' store the mesh arrays as the keyframe at progress '''
+		buffer = io.BytesIO()
+		np.savez_compressed(buffer, vertices=np.asarray(vertices, dtype=np.float32), faces=np.asarray(faces, dtype=np.int32))
+		data = buffer.getvalue()
+
+		idx = bisect.bisect_left(self.keys, progress)
+		if idx == len(self.keys) or self.keys[idx] != progress:
+			self.keys.insert(idx, progress)
+		self.memory.put(progress, data, len(data))
+
+	def get(self, progress):
+		''' return the (vertices, faces) arrays of the last keyframe at or before progress, or None '''
+		idx = bisect.bisect_right(self.keys, progress) - 1
+		while idx >= 0:
+			key = self.keys[idx]
+			data = self.memory.get(key)
+			if data is not None:
+				source = io.BytesIO(data)
+			else:
+				source = self.spillPath(key)
+				if source is None or not os.path.exists(source):
+					# evicted without spilling
+					del self.keys[idx]
+					idx -= 1
+					continue
+			with np.load(source) as arrays:
+				return arrays["vertices"].astype(np.float64), arrays["faces"].astype(np.int64)
+		return None
+
+	def spillPath(self, key):
+		if self.spillDir is None:
+			return None
+		return os.path.join(self.spillDir, "frame_{!r}.npz".format(key))
+
+	def evict(self, key, data):
+		if not self.spill:
+			return
+		try:
+			if self.spillDir is None:
+				self.spillDir = tempfile.mkdtemp(prefix="pathsim_frames_")
+			with open(self.spillPath(key), "wb") as f:
+				f.write(data)
+		except OSError as e:
+			print("PathSimCache: unable to spill frame:", e)
+
+	def clear(self):
+		''' remove every keyframe, in memory and on disk '''
+		self.memory.clear()
+		self.keys = []
+		self.complete = False
+		if self.spillDir is not None:
+			shutil.rmtree(self.spillDir, ignore_errors=True)
+			self.spillDir = None
+
+
+def setCacheDir(cacheDir, tessellations=False):
+	''' keep the path cache in cacheDir, and the tessellations too if tessellations is set. None keeps them in memory only '''
+	tessellationCache.setCacheDir(cacheDir if tessellations else None)
+	pathCache.setCacheDir(cacheDir)
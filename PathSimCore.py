@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import time
+import threading
+import importlib
+
+import numpy as np
+
+import FreeCAD
+
+from engines import mesh_utils
+import PathSimCache
+import PathSimPath
+import PathSimScheduler
+import PathSimTool
+
+
+def loadEngine(engine):
+	''' import the named engine module from the engines package and return a new engine '''
+	print("PathSim: Setup Engine:", engine)
+	engineModule = importlib.import_module("engines.{}".format(engine))
+	return engineModule.Engine()
+
+
+def snapshotSize(state):
+	''' approximate memory used by an engine snapshot, counting the numpy arrays it holds '''
+	if isinstance(state, np.ndarray):
+		return state.nbytes
+	if isinstance(state, (tuple, list)):
+		return sum(snapshotSize(item) for item in state)
+	return 0
+
+
+class Checkpoints:
+	''' engine snapshots taken along the path, used to seek without re-running from the start
+
+	a snapshot is taken every interval mm of path. when the snapshots exceed budget bytes
+	every other one is dropped and the interval doubled.
+	'''
+
+	def __init__(self, interval=None, budget=512 * 1024 * 1024):
+		self.interval = interval  # None spaces checkpoints at 1% of the path length
+		self.budget = budget
+		self.distances = []
+		self.states = []
+		self.sizes = []
+		self.spacing = 0.0
+
+	def reset(self, totalLength):
+		self.distances = []
+		self.states = []
+		self.sizes = []
+		self.spacing = self.interval or max(totalLength / 100.0, 1e-6)
+
+	def due(self, distance):
+		''' return True if a checkpoint should be taken at distance '''
+		if not self.distances:
+			return True
+		return distance - self.distances[-1] >= self.spacing
+
+	def add(self, distance, state):
+		idx = int(np.searchsorted(self.distances, distance))
+		if idx < len(self.distances) and self.distances[idx] == distance:
+			return
+		self.distances.insert(idx, distance)
+		self.states.insert(idx, state)
+		self.sizes.insert(idx, snapshotSize(state))
+
+		while sum(self.sizes) > self.budget and len(self.distances) > 1:
+			# thin out, always keeping the first checkpoint at the start of the path
+			keep = [0] + list(range(2, len(self.distances), 2))
+			self.distances = [self.distances[i] for i in keep]
+			self.states = [self.states[i] for i in keep]
+			self.sizes = [self.sizes[i] for i in keep]
+			self.spacing *= 2
+
+	def nearest(self, distance):
+		''' return (distance, state) of the last checkpoint at or before distance, or None '''
+		idx = int(np.searchsorted(self.distances, distance, side='right')) - 1
+		if idx < 0:
+			return None
+		return self.distances[idx], self.states[idx]
+
+
+class MeshWorker:
+	''' builds stock meshes from engine snapshots on a background thread so cutting never waits for them
+
+	only one mesh is built at a time. a request that arrives while another is waiting replaces it,
+	dropped counts the mesh frames lost because the worker was busy.
+	'''
+
+	def __init__(self, build, publish):
+		self.build = build  # called with a snapshot, returns the mesh to publish
+		self.publish = publish  # called with (mesh, progress, keyframe, cost) on the worker thread
+		self.condition = threading.Condition()
+		self.pending = None
+		self.busy = False
+		self.running = False
+		self.dropped = 0
+		self.buildCost = 0.0  # seconds spent building meshes since the last takeCost
+		self.thread = None
+
+	def start(self):
+		self.running = True
+		self.dropped = 0
+		self.buildCost = 0.0
+		self.thread = threading.Thread(target=self.work, name="PathSimMesh", daemon=True)
+		self.thread.start()
+
+	def idle(self):
+		''' return True if no mesh is being built or waiting to be built '''
+		with self.condition:
+			return self.pending is None and not self.busy
+
+	def submit(self, state, progress, keyframe=False):
+		''' request a mesh of the snapshot state '''
+		with self.condition:
+			if self.pending is not None:
+				self.dropped += 1
+			self.pending = (state, progress, keyframe)
+			self.condition.notify_all()
+
+	def takeCost(self):
+		''' return the seconds spent building meshes since the last call '''
+		with self.condition:
+			cost = self.buildCost
+			self.buildCost = 0.0
+			return cost
+
+	def flush(self):
+		''' wait until every request has been published '''
+		with self.condition:
+			while self.running and (self.pending is not None or self.busy):
+				self.condition.wait()
+
+	def stop(self):
+		''' stop the worker, a request that hasn't started is discarded '''
+		with self.condition:
+			self.running = False
+			self.pending = None
+			self.condition.notify_all()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def work(self):
+		while True:
+			with self.condition:
+				while self.running and self.pending is None:
+					self.condition.wait()
+				if not self.running:
+					return
+				state, progress, keyframe = self.pending
+				self.pending = None
+				self.busy = True
+
+			t = time.perf_counter()
+			try:
+				mesh = self.build(state)
+				self.publish(mesh, progress, keyframe, time.perf_counter() - t)
+			except Exception as e:
+				print("PathSim: mesh update failed:", e)
+			finally:
+				with self.condition:
+					self.buildCost += time.perf_counter() - t
+					self.busy = False
+					self.condition.notify_all()
+
+
+def findJob(doc):
+	''' return the first job in doc or None '''
+	jobs = doc.findObjects("Path::FeaturePython", "Job.*")
+	if jobs:
+		return jobs[0]
+	return None
+
+
+class Simulation:
+	''' simulation loop with no gui dependencies
+
+	the gui thread and headless runs share this loop. poses, meshes and progress are
+	reported through the optional callbacks at the rate set by the scheduler.
+	'''
+
+	def __init__(self):
+		self.operations = []
+		self.job = None
+		self.stepDistance = 2
+		self.sampleSettings = {}
+		self.running = False
+		self.idx = 0  # index of current position
+		self.distance = 0.0  # path length simulated
+		self.stream = None
+		self.seekTo = None  # progress requested by skipTo
+		self.engine = None
+		self.scheduler = PathSimScheduler.FrameScheduler(speed=0)
+		self.mappedPath = True  # record the expanded path in a memory mapped file for seeking
+		self.checkpoints = Checkpoints()
+		self.seekable = True  # take checkpoints to seek from, runs that never seek turn this off
+		self.batchSize = 1024  # most positions passed to processPositions at once
+		self.meshWorker = None  # builds meshes off the simulation thread for engines that support it
+		self.asyncMesh = True
+		self.patches = {}  # latest mesh of every stock tile
+		self.patchMode = False
+		self.meshBudget = 250000  # most triangles in meshes shown during playback, None for full resolution
+		self.fullDetail = False  # True while the full resolution mesh is published
+		self.refreshOnStop = True  # publish the full resolution mesh when stopped
+		self.frames = PathSimCache.FrameCache()  # meshes captured during the run for scrubbing
+		self.timings = {}
+
+		# callbacks
+		self.onPosition = None  # called with a FreeCAD.Placement
+		self.onMesh = None  # called with the stock mesh as (vertices, faces) arrays
+		self.onPatches = None  # called with the changed tiles of engines that mesh in patches, {tile: (vertices, faces)}
+		self.onProgress = None  # called with progress where 1 = 100%
+		self.onOperation = None  # called with the operation being simulated
+
+	def setEngine(self, engine):
+		if self.engine is not None and self.engine is not engine and hasattr(self.engine, "close"):
+			self.engine.close()
+		self.engine = engine
+
+	def setJob(self, job):
+		self.job = job
+
+	def setOperations(self, operations, settings=None):
+		''' set the operations to simulate. settings optionally maps operation names to PathSimPath.SampleSettings '''
+		self.operations = operations
+		self.sampleSettings = settings or {}
+		self.newStream()
+
+	def newStream(self):
+		''' replace the path stream, the expanded path is recorded again for the new settings '''
+		if self.stream is not None:
+			self.stream.close()
+		store = PathSimPath.PathStore() if self.mappedPath else None
+		self.stream = PathSimPath.PathStream(self.operations, self.stepDistance, settings=self.sampleSettings, store=store)
+
+	def setStepDistance(self, stepDistance):
+		''' set the sampling distance, the path is re-sampled without being recompiled '''
+		self.stepDistance = stepDistance
+		if self.stream is not None and self.stream.stepDistance != stepDistance:
+			self.stream.stop()
+			self.stream.stepDistance = stepDistance
+			if self.stream.store is not None:
+				# the recorded points are for the old step distance
+				self.stream.store.close()
+				self.stream.store = PathSimPath.PathStore()
+
+	def setSpeed(self, speed):
+		''' set the playback speed multiplier, 0 runs as fast as the engine allows '''
+		self.scheduler.setSpeed(speed, self.distance)
+
+	def stop(self, refresh=True):
+		''' stop the simulation, with refresh the stock is shown at full resolution once it has stopped '''
+		self.refreshOnStop = refresh
+		self.running = False
+
+	def skipTo(self, progress):
+		''' skip the the selected point: progress is a percentage where 1 = 100% '''
+		self.seekTo = progress
+
+	def close(self):
+		''' release the path stream, its store, the captured frames and any engine workers '''
+		if self.stream is not None:
+			self.stream.close()
+			self.stream = None
+		self.frames.clear()
+		if hasattr(self.engine, "close"):
+			self.engine.close()
+
+	def frameAt(self, progress):
+		''' return the stock mesh captured at or before progress as (vertices, faces) arrays, or None '''
+		return self.frames.get(progress)
+
+	def run(self):
+		''' run the simulation, returns True if the path ran to completion '''
+		if self.engine is None:
+			print("engine not set")
+			return False
+
+		job = self.job
+		if job is None:
+			job = findJob(FreeCAD.ActiveDocument)
+
+		self.idx = 0  # reset the progress to 0
+		self.distance = 0.0
+		self.running = True
+		self.timings = {"stock": 0.0, "tool": 0.0, "engine": 0.0, "mesh": 0.0, "snapshot": 0.0, "total": 0.0,
+			"positions": 0, "culled": 0, "meshesDropped": 0}
+		startTime = time.perf_counter()
+
+		try:
+			profiles = [PathSimTool.ToolProfile.fromTool(op.ToolController.Tool) for op in self.operations]
+			if hasattr(self.engine, "setTools"):
+				# engines that size themselves to the tools
+				self.engine.setTools(profiles)
+
+			t = time.perf_counter()
+			self.engine.setStock(job.Stock.Shape)
+			self.timings["stock"] += time.perf_counter() - t
+
+			# positions where the tool is clear of the stock are animated but not cut
+			bb = job.Stock.Shape.BoundBox
+			bounds = (bb.XMin, bb.YMin, bb.ZMin, bb.XMax, bb.YMax, bb.ZMax)
+			radii = np.array([profile.radius for profile in profiles])
+			lengths = np.array([profile.length for profile in profiles])
+
+			# engines that can snapshot their state seek by restoring the nearest checkpoint
+			snapshots = hasattr(self.engine, "snapshot") and hasattr(self.engine, "restore")
+			checkpoints = snapshots and self.seekable
+			self.checkpoints.reset(self.stream.totalLength)
+			self.frames.clear()
+			replayUntil = 0.0
+
+			# engines that track changed tiles only remesh those
+			self.patches = {}
+			self.patchMode = self.onPatches is not None and hasattr(self.engine, "meshPatches")
+
+			# meshes are simplified during playback, by the engine when it can
+			self.fullDetail = False
+			self.refreshOnStop = True
+			if hasattr(self.engine, "meshBudget"):
+				self.engine.meshBudget = self.meshBudget
+
+			# engines that can mesh a snapshot have their meshes built on a worker thread
+			if self.asyncMesh and snapshots:
+				if self.patchMode:
+					self.meshWorker = MeshWorker(self.buildPatches, self.showPatches)
+				elif self.onMesh and hasattr(self.engine, "snapshotArrays"):
+					self.meshWorker = MeshWorker(self.engine.snapshotArrays, self.showMesh)
+			if self.meshWorker is not None:
+				self.meshWorker.start()
+
+			## Expand the path while simulating
+			self.seekTo = None
+			self.stream.start()
+			self.scheduler.start()
+			block = None
+			blockIdx = 0
+			rot = FreeCAD.Rotation(FreeCAD.Vector(0, 0, 1), 0)
+			position = (0.0, 0.0, 0.0)  # last tool position
+			currentOp = -1
+			completed = False
+			# engines that cut swept volumes get one call per move instead of a call per point
+			sweep = hasattr(self.engine, "processSegment")
+			sweepSegment = None
+			# other engines that take arrays of positions are fed a batch of points per frame
+			batch = not sweep and hasattr(self.engine, "processPositions")
+			culled = 0
+
+			while True:
+
+				if not self.running:
+					break
+
+				if self.seekTo is not None:
+					target = self.seekTo * self.stream.totalLength
+					self.seekTo = None
+					if checkpoints:
+						checkpoint = self.checkpoints.nearest(target)
+						if checkpoint is not None and (target < self.distance or checkpoint[0] > self.distance):
+							self.distance, state = checkpoint
+							self.engine.restore(state)
+						# replay from the current state or checkpoint to the target at full speed
+						replayUntil = target
+					else:
+						self.distance = target
+					self.stream.start(self.distance)
+					self.scheduler.start(target)
+					block = None
+					sweepSegment = None
+					currentOp = -1
+
+				if block is None or blockIdx >= len(block):
+					block = self.stream.next()
+					blockIdx = 0
+					if block is None:
+						completed = True
+						break
+					if not sweep:
+						cutting = PathSimPath.cuttingMask(block.positions, radii[block.opIndex], lengths[block.opIndex], bounds)
+					continue
+
+				if block.opIndex[blockIdx] != currentOp:
+					currentOp = block.opIndex[blockIdx]
+					operation = block.operations[currentOp]
+					print("Load Tool for op:", operation.Label)
+					t = time.perf_counter()
+					tool = operation.ToolController.Tool
+					self.engine.setTool(tool.Shape)
+					if hasattr(self.engine, "setToolProfile"):
+						self.engine.setToolProfile(profiles[currentOp])
+					self.timings["tool"] += time.perf_counter() - t
+					if self.onOperation:
+						self.onOperation(operation)
+
+				t = time.perf_counter()
+				end = blockIdx + 1
+				if sweep:
+					segment = (block.segments, block.segIdx[blockIdx])
+					if sweepSegment is None or segment[0] is not sweepSegment[0] or segment[1] != sweepSegment[1]:
+						sweepSegment = segment
+						# whole moves are cut at once, so checkpoints can only be taken between moves
+						self.checkpoint(checkpoints, max(self.distance, segment[0].offsets[segment[1]]))
+						if segment[0].cuttingMask(radii[currentOp], lengths[currentOp], bounds)[segment[1]]:
+							self.cutSegment(segment[0], segment[1], self.distance, rot)
+						else:
+							culled += 1
+				elif batch:
+					end = self.batchEnd(block, blockIdx, replayUntil)
+					self.checkpoint(checkpoints, self.distance)
+					positions = block.positions[blockIdx:end][cutting[blockIdx:end]]
+					if len(positions):
+						self.engine.processPositions(positions)
+					culled += end - blockIdx - len(positions)
+				else:
+					self.checkpoint(checkpoints, self.distance)
+					if cutting[blockIdx]:
+						x, y, z = block.positions[blockIdx]
+						self.engine.processPosition(FreeCAD.Placement(FreeCAD.Vector(x, y, z), rot))
+					else:
+						culled += 1
+				self.timings["engine"] += time.perf_counter() - t
+				position = block.positions[end - 1]
+				self.distance = block.distances[end - 1]
+				self.idx += end - blockIdx
+				blockIdx = end
+
+				if self.distance < replayUntil:
+					# catching up after a seek, nothing is shown
+					continue
+
+				if self.scheduler.poseDue():
+					self.publishPose(position, rot)
+
+				if (self.onMesh or self.patchMode) and self.scheduler.meshDue():
+					self.publishMesh()
+
+				self.scheduler.pace(self.distance)
+
+			if self.meshWorker is not None:
+				if completed:
+					self.meshWorker.flush()
+				self.meshWorker.stop()
+				self.timings["meshesDropped"] = self.meshWorker.dropped
+				self.meshWorker = None
+
+			if completed or self.refreshOnStop:
+				# show the final state whatever the frame timing
+				self.publishPose(position, rot)
+				self.refreshMesh()
+				self.frames.complete = completed and (self.onMesh is not None or self.patchMode)
+		finally:
+			# an engine or path failure must not leave the worker threads running
+			if self.meshWorker is not None:
+				self.meshWorker.stop()
+				self.meshWorker = None
+			if self.stream is not None:
+				self.stream.stop()
+			self.running = False
+
+		self.timings["positions"] = self.idx
+		self.timings["culled"] = culled  # positions or moves in sweep mode
+		self.timings["total"] = time.perf_counter() - startTime
+		return completed
+
+	def checkpoint(self, enabled, distance):
+		''' snapshot the engine if a checkpoint is due, the stock has been cut up to distance '''
+		if enabled and self.checkpoints.due(distance):
+			self.checkpoints.add(distance, self.engine.snapshot())
+
+	def batchEnd(self, block, start, replayUntil):
+		''' return the end of the run of points from start that is passed to the engine in one call
+
+		a batch uses a single tool and ends at the first point a frame is due or a replay completes
+		'''
+		end = min(len(block), start + self.batchSize)
+		ops = block.opIndex[start:end]
+		change = np.flatnonzero(ops != ops[0])
+		if len(change):
+			end = start + change[0]
+
+		limit = self.distance + self.scheduler.frameDistance()
+		if self.distance < replayUntil:
+			limit = min(limit, replayUntil)
+		end = min(end, start + int(np.searchsorted(block.distances[start:end], limit)) + 1)
+		return max(end, start + 1)
+
+	def cutSegment(self, segments, segIdx, fromDistance, rot):
+		''' pass the move segIdx of the segment table to the engine, starting at fromDistance along the path '''
+		start = segments.starts[segIdx]
+		if fromDistance > segments.offsets[segIdx] + 1e-9:
+			# started part way along the move i.e. after a seek
+			start = segments.positionAt(np.array([fromDistance]))[0]
+		end = segments.ends[segIdx]
+
+		centre = None
+		clockwise = False
+		if segments.types[segIdx] >= PathSimPath.MOVE_CW:
+			cx, cy, cz = segments.centres[segIdx]
+			centre = FreeCAD.Vector(cx, cy, cz)
+			clockwise = segments.types[segIdx] == PathSimPath.MOVE_CW
+
+		self.engine.processSegment(
+			FreeCAD.Placement(FreeCAD.Vector(*start), rot),
+			FreeCAD.Placement(FreeCAD.Vector(*end), rot),
+			centre, clockwise)
+
+	def publishPose(self, position, rot):
+		''' report the tool position and progress '''
+		if self.onPosition:
+			x, y, z = position
+			self.onPosition(FreeCAD.Placement(FreeCAD.Vector(x, y, z), rot))
+		if self.onProgress and self.stream.totalLength:
+			self.onProgress(min(self.distance / self.stream.totalLength, 1.0))
+
+	def publishMesh(self, keyframe=False):
+		''' report the current stock mesh, keeping it as a keyframe when one is due '''
+		if not self.onMesh and not self.patchMode:
+			return
+		progress = min(self.distance / self.stream.totalLength, 1.0) if self.stream.totalLength else 1.0
+
+		if self.meshWorker is not None:
+			# double buffered: the worker meshes a copy of the stock while cutting continues
+			if not self.meshWorker.idle():
+				# the previous mesh is still being built, skip this frame
+				self.meshWorker.dropped += 1
+				self.scheduler.meshSkipped()
+				return
+			t = time.perf_counter()
+			if self.patchMode:
+				# only the windows of the changed tiles are copied
+				tiles = self.engine.dirtyTiles()
+				state = (self.engine.snapshotTiles(tiles), tiles)
+			else:
+				state = self.engine.snapshot()
+			self.meshWorker.submit(state, progress, keyframe)
+			cost = time.perf_counter() - t
+			self.timings["snapshot"] += cost
+			# the worker is idle so the previous mesh is built, charge its cost with the snapshot
+			self.scheduler.meshDone(cost + self.meshWorker.takeCost())
+			return
+
+		t = time.perf_counter()
+		if self.patchMode:
+			mesh = self.engine.meshPatches(self.engine.dirtyTiles())
+		else:
+			mesh = self.stockArrays()
+		cost = time.perf_counter() - t
+		self.scheduler.meshDone(cost)
+		if self.patchMode:
+			self.showPatches(mesh, progress, keyframe, cost)
+		else:
+			self.showMesh(mesh, progress, keyframe, cost)
+
+	def stockArrays(self):
+		''' return the (vertices, faces) arrays of the stock, through a Mesh.Mesh for engines without array output '''
+		if hasattr(self.engine, "getArrays"):
+			return self.engine.getArrays()
+		return mesh_utils.meshArrays(self.engine.getMesh())
+
+	def refreshMesh(self):
+		''' publish the stock at full resolution, this is done when the simulation completes or is stopped '''
+		self.fullDetail = True
+		if hasattr(self.engine, "meshBudget"):
+			self.engine.meshBudget = None
+		self.publishMesh(keyframe=True)
+
+	def buildPatches(self, request):
+		''' mesh the changed tiles of a (snapshotTiles, tiles) request '''
+		state, tiles = request
+		return self.engine.meshPatches(tiles, state)
+
+	def showPatches(self, patches, progress, keyframe, cost):
+		''' keep the changed tile meshes, the whole stock as a keyframe when one is due, and report them '''
+		self.timings["mesh"] += cost
+		self.patches.update(patches)
+		if keyframe or self.frames.due(progress):
+			self.frames.add(progress, *mesh_utils.combinePatches(self.patches))
+		if patches:
+			self.onPatches(patches)
+
+	def showMesh(self, mesh, progress, keyframe, cost):
+		''' keep the (vertices, faces) mesh as a keyframe when one is due and report it, cost is the time taken to build it '''
+		if self.meshBudget and not self.fullDetail and not hasattr(self.engine, "meshBudget"):
+			# engines that don't simplify their own meshes are decimated during playback
+			t = time.perf_counter()
+			mesh = mesh_utils.decimate(*mesh, self.meshBudget)
+			cost += time.perf_counter() - t
+		self.timings["mesh"] += cost
+		if keyframe or self.frames.due(progress):
+			self.frames.add(progress, *mesh)
+		self.onMesh(mesh)
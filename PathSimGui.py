@@ -28,12 +28,15 @@ from PySide import QtGui, QtCore
 
 import FreeCAD
 import FreeCADGui
-import Mesh
 
 import Path.Base.Util as PathUtil
 
 import PathSim
+import PathSimCache
+import PathSimPath
 import PathSimTimelineGui
+import PathSimView
+from engines import mesh_utils
 
 dir = os.path.dirname(__file__)
 ui_name = "PathSimGui.ui"
@@ -45,19 +48,27 @@ class PathSimPanel:
 		# self will create a Qt widget from the ui file
 		self.form = FreeCADGui.PySideUic.loadUi(path_to_ui)
 
-		self.tool = None
 		self.sim = PathSim.PathSim()
 		self.jobs = []
-		self.meshView = None
+		self.view = PathSimView.SimView()  # stock and tool drawn in the 3d view
 		self.counter = 0
+		self.operations = []
+		self.sampleSettings = {}  # operation name: PathSimPath.SampleSettings
 
 		self.timeline = PathSimTimelineGui.timeline()
 
 		# connect ui components
 		self.form.comboJobs.currentIndexChanged.connect(self.onJobChange)
+		self.form.listOperations.currentRowChanged.connect(self.onOperationSelected)
+		self.form.checkAdaptive.toggled.connect(self.onSampleSettingsChanged)
+		self.form.spinStepDistance.valueChanged.connect(self.onSampleSettingsChanged)
+		self.form.spinChordTolerance.valueChanged.connect(self.onSampleSettingsChanged)
+		self.form.spinToolFraction.valueChanged.connect(self.onSampleSettingsChanged)
+		self.form.spinRapidStep.valueChanged.connect(self.onSampleSettingsChanged)
 		self.sim.updatePos.connect(self.setPos)
 		self.sim.complete.connect(self.simComplete)
 		self.sim.updateMesh.connect(self.updateMesh)
+		self.sim.updatePatches.connect(self.updatePatches)
 		self.sim.progress.connect(self.timeline.setProgress)
 		self.sim.cleanup.connect(self.cleanup)
 		self.sim.changedOp.connect(self.loadTool)
@@ -66,6 +77,8 @@ class PathSimPanel:
 		self.timeline.playSignal.connect(self.simPlay)
 		self.timeline.stopSignal.connect(self.simStop)
 		self.timeline.skipRequested.connect(self.sim.skipTo)
+		self.timeline.scrubRequested.connect(self.sim.scrubTo)
+		self.timeline.speedChanged.connect(self.sim.setSpeed)
 
 		self.setupUi()
 
@@ -103,6 +116,7 @@ class PathSimPanel:
 	def quit(self):
 		self.timeline.quit()
 		self.simStop()
+		self.sim.close()
 		self.cleanup()
 		FreeCADGui.Control.closeDialog()
 		
@@ -122,6 +136,57 @@ class PathSimPanel:
 				self.operations.append(op)
 				self.form.listOperations.addItem(listItem)
 
+		if self.operations:
+			self.form.listOperations.setCurrentRow(0)
+
+	def getSampleSettings(self, op):
+		''' return the sample settings for op, creating the defaults if required '''
+		if op.Name not in self.sampleSettings:
+			self.sampleSettings[op.Name] = PathSimPath.SampleSettings(self.sim.stepDistance)
+		return self.sampleSettings[op.Name]
+
+	def onOperationSelected(self, row):
+		''' show the sample settings of the selected operation '''
+		self.form.groupSampling.setEnabled(row >= 0)
+		if row < 0 or row >= len(self.operations):
+			return
+
+		settings = self.getSampleSettings(self.operations[row])
+		widgets = [self.form.checkAdaptive, self.form.spinStepDistance, self.form.spinChordTolerance,
+			self.form.spinToolFraction, self.form.spinRapidStep]
+		for widget in widgets:
+			widget.blockSignals(True)
+		self.form.checkAdaptive.setChecked(settings.adaptive)
+		self.form.spinStepDistance.setValue(settings.stepDistance)
+		self.form.spinChordTolerance.setValue(settings.chordTolerance)
+		self.form.spinToolFraction.setValue(int(round(settings.toolFraction * 100)))
+		self.form.spinRapidStep.setValue(settings.rapidStep)
+		for widget in widgets:
+			widget.blockSignals(False)
+		self.updateSamplingWidgets()
+
+	def onSampleSettingsChanged(self, value=None):
+		''' store the sample settings for the selected operation '''
+		row = self.form.listOperations.currentRow()
+		if row < 0 or row >= len(self.operations):
+			return
+
+		settings = self.getSampleSettings(self.operations[row])
+		settings.adaptive = self.form.checkAdaptive.isChecked()
+		settings.stepDistance = self.form.spinStepDistance.value()
+		settings.chordTolerance = self.form.spinChordTolerance.value()
+		settings.toolFraction = self.form.spinToolFraction.value() / 100.0
+		settings.rapidStep = self.form.spinRapidStep.value()
+		self.updateSamplingWidgets()
+
+	def updateSamplingWidgets(self):
+		''' enable the widgets relevant to the sampling mode '''
+		adaptive = self.form.checkAdaptive.isChecked()
+		self.form.spinStepDistance.setEnabled(not adaptive)
+		self.form.spinChordTolerance.setEnabled(adaptive)
+		self.form.spinToolFraction.setEnabled(adaptive)
+		self.form.spinRapidStep.setEnabled(adaptive)
+
 	def getOperations(self):
 		activeOps = []
 		for i in range(self.form.listOperations.count()):
@@ -141,20 +206,21 @@ class PathSimPanel:
 			return
 		
 		self.cleanup()
-		self.meshView = FreeCAD.ActiveDocument.addObject("Mesh::Feature", "cutshape")
-		job = FreeCAD.ActiveDocument.findObjects("Path::FeaturePython", "Job.*")[0]
-		self.meshView.Mesh = Mesh.Mesh(job.Stock.Shape.tessellate(0.1))
+		prefs = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/PathSim")
+		PathSimCache.setCacheDir(PathSimCache.documentCacheDir(FreeCAD.ActiveDocument), prefs.GetBool("SaveTessellations", False))
+		vertices, faces = mesh_utils.tessellationArrays(self.job.Stock.Shape, 0.1)
+		self.view.attach()
+		self.view.setStockArrays(vertices, faces)
 
 		self.sim.setupEngine(self.form.comboEngines.currentText())
-		self.sim.setOperations(operations)
+		self.sim.setJob(self.job)
+		self.sim.setSpeed(self.timeline.speed())
+		self.sim.setOperations(operations, self.sampleSettings)
 		self.sim.start()
 	
 	def loadTool(self, op):
 		''' load the tool for the operation '''
-		if self.tool is None:
-			self.tool = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", "Tool")
-			self.tool.ViewObject.Proxy = 0
-		self.tool.Shape = op.ToolController.Tool.Shape
+		self.view.setTool(op.ToolController.Tool.Shape)
 
 	def simStop(self):
 		if self.sim.isRunning() or not self.sim.isFinished():
@@ -162,33 +228,32 @@ class PathSimPanel:
 
 	def setPos(self, pos):
 		# update tool position 
-		self.tool.Placement = pos
+		self.view.setToolPlacement(pos)
 
 	def cleanup(self):
 		self.cleanupStock()
 		self.cleanupTool()
+		self.view.detach()
 
 	def cleanupTool(self):
-		''' Delete the tool created for the simulation '''
-		if self.tool is not None:
-			FreeCAD.ActiveDocument.removeObject(self.tool.Name)
-			self.tool = None
+		''' Hide the tool shown for the simulation '''
+		self.view.hideTool()
 
 	def cleanupStock(self):
-		''' Delete the stock created for the simulation '''
-		if self.meshView is not None:
-			FreeCAD.ActiveDocument.removeObject(self.meshView.Name)
-			self.meshView = None
+		''' Remove the stock shown for the simulation '''
+		self.view.clearStock()
 
 	def simComplete(self):
 		''' slot called on simulation completion'''
 		self.cleanupTool()
 
-	def updateMesh(self, mesh):
-		''' slot called at intervals to update the meshView'''
-		if self.meshView is not None:
-			self.meshView.Mesh = mesh
-			FreeCAD.ActiveDocument.recompute()
+	def updateMesh(self, arrays):
+		''' slot called at intervals to update the stock view with (vertices, faces) arrays'''
+		self.view.setStockArrays(*arrays)
+
+	def updatePatches(self, patches):
+		''' slot called with the stock tiles that changed since the last update '''
+		self.view.setPatches(patches)
 
 def Show():
 	panel = PathSimPanel()
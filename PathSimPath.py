@@ -0,0 +1,666 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import math
+import queue
+import tempfile
+import threading
+
+import numpy as np
+
+import PathSimCache
+
+# move types
+MOVE_RAPID = 0
+MOVE_FEED = 1
+MOVE_CW = 2
+MOVE_CCW = 3
+
+MOVE_TYPES = {
+	"G0": MOVE_RAPID, "G00": MOVE_RAPID,
+	"G1": MOVE_FEED, "G01": MOVE_FEED,
+	"G2": MOVE_CW, "G02": MOVE_CW,
+	"G3": MOVE_CCW, "G03": MOVE_CCW,
+}
+
+
+class PathPoints:
+	''' expanded tool path stored as contiguous arrays
+
+	positions is an (N, 3) float64 array, opIndex an (N,) array indexing into the operations table
+	and distances the (N,) path length travelled to reach each point
+	'''
+
+	def __init__(self, positions=None, opIndex=None, operations=None, distances=None, segments=None, segIdx=None):
+		if positions is None:
+			positions = np.empty((0, 3), dtype=np.float64)
+		if opIndex is None:
+			opIndex = np.empty(0, dtype=np.uint16)
+		if distances is None:
+			distances = np.empty(0, dtype=np.float64)
+		self.positions = positions
+		self.opIndex = opIndex
+		self.distances = distances
+		self.operations = operations or []
+		self.segments = segments  # SegmentTable the points were sampled from
+		self.segIdx = segIdx  # index of the segment in self.segments for each point
+
+	def __len__(self):
+		return len(self.positions)
+
+	def slice(self, start, stop=None):
+		''' return the points [start:stop] as a new PathPoints object sharing the operations table '''
+		segIdx = None if self.segIdx is None else self.segIdx[start:stop]
+		return PathPoints(self.positions[start:stop], self.opIndex[start:stop], self.operations,
+			self.distances[start:stop], self.segments, segIdx)
+
+
+class SegmentTable:
+	''' compiled line and arc segments of a tool path
+
+	each row describes one motion command: start, end and centre (M, 3) arrays,
+	the move type, arc start angle, sweep and radius, the segment length and the
+	index of the operation it belongs to. offsets holds the path length at the
+	start of each segment with the total length appended.
+	'''
+
+	def __init__(self, starts, ends, centres, types, opIndex, operations, startOffset=0.0):
+		# drop moves that don't move the tool i.e. feed rate changes
+		lengths = moveLengths(starts, ends, centres, types)
+		keep = lengths > 1e-9
+
+		self.starts = starts[keep]
+		self.ends = ends[keep]
+		self.centres = centres[keep]
+		self.types = types[keep]
+		self.opIndex = opIndex[keep]
+		self.lengths = lengths[keep]
+		self.operations = operations
+		self.startAngles, self.sweeps, self.radii = arcSweep(self.starts, self.ends, self.centres, self.types)
+		self.offsets = np.concatenate(([0.0], np.cumsum(self.lengths))) + startOffset
+		self.masks = {}  # cutting masks by tool size and stock bounds
+
+	def __len__(self):
+		return len(self.types)
+
+	@property
+	def startOffset(self):
+		return self.offsets[0]
+
+	@property
+	def totalLength(self):
+		''' path length at the end of the table '''
+		return self.offsets[-1]
+
+	def evaluate(self, segIdx, t):
+		''' return the positions at parameter t (0 - 1) along the segments segIdx '''
+		segIdx = np.asarray(segIdx)
+		t = np.asarray(t, dtype=np.float64)
+		s = self.starts[segIdx]
+		e = self.ends[segIdx]
+		positions = s + (e - s) * t[..., None]
+
+		arcs = self.types[segIdx] >= MOVE_CW
+		if arcs.any():
+			arcSeg = segIdx[arcs]
+			angle = self.startAngles[arcSeg] + self.sweeps[arcSeg] * t[arcs]
+			positions[arcs, 0] = self.centres[arcSeg, 0] + np.cos(angle) * self.radii[arcSeg]
+			positions[arcs, 1] = self.centres[arcSeg, 1] + np.sin(angle) * self.radii[arcSeg]
+
+		# finish each move exactly on its programmed end point
+		last = t == 1.0
+		positions[last] = e[last]
+		return positions
+
+	def locate(self, distance):
+		''' return the segment index and segment parameter t for path length distance '''
+		distance = np.clip(np.asarray(distance, dtype=np.float64), self.startOffset, self.totalLength)
+		segIdx = np.searchsorted(self.offsets, distance, side='right') - 1
+		segIdx = np.clip(segIdx, 0, len(self) - 1)
+		t = (distance - self.offsets[segIdx]) / self.lengths[segIdx]
+		return segIdx, np.clip(t, 0.0, 1.0)
+
+	def positionAt(self, distance):
+		''' return the tool position after travelling distance along the path '''
+		segIdx, t = self.locate(distance)
+		return self.evaluate(segIdx, t)
+
+	def boundingBoxes(self):
+		''' return (lower, upper) (M, 3) arrays bounding each segment, arcs are bounded by their full circle '''
+		lower = np.minimum(self.starts, self.ends)
+		upper = np.maximum(self.starts, self.ends)
+		arcs = self.types >= MOVE_CW
+		lower[arcs, :2] = self.centres[arcs, :2] - self.radii[arcs, None]
+		upper[arcs, :2] = self.centres[arcs, :2] + self.radii[arcs, None]
+		return lower, upper
+
+	def cuttingMask(self, radius, length, bounds):
+		''' return a boolean mask of the segments where a tool of radius and length may touch bounds '''
+		key = (radius, length, bounds)
+		mask = self.masks.get(key)
+		if mask is None:
+			lower, upper = self.boundingBoxes()
+			mask = boxesOverlap(lower, upper, radius, length, bounds)
+			self.masks[key] = mask
+		return mask
+
+	def sample(self, settings, first=0, last=None):
+		''' sample the segments [first:last] using settings, a SampleSettings object or a step distance.
+		returns a PathPoints object
+
+		the start of each segment is not included, the end always is.
+		'''
+		if last is None:
+			last = len(self)
+		counts = asSampleSettings(settings).segmentCounts(self, first, last)
+		total = int(counts.sum())
+		segIdx = np.repeat(np.arange(first, first + len(counts)), counts)
+		firstIdx = np.cumsum(counts) - counts
+		step = np.arange(1, total + 1) - np.repeat(firstIdx, counts)
+		t = step / np.repeat(counts, counts)
+
+		positions = self.evaluate(segIdx, t)
+		distances = self.offsets[segIdx] + self.lengths[segIdx] * t
+		return PathPoints(positions, self.opIndex[segIdx], self.operations, distances, self, segIdx)
+
+	def sampleBlocks(self, settings, blockSize, startDistance=0.0, after=False):
+		''' generator yielding PathPoints blocks of roughly blockSize points, starting at startDistance
+
+		with after set the point at startDistance itself is excluded
+		'''
+		if not len(self) or startDistance > self.totalLength:
+			return
+
+		settings = asSampleSettings(settings)
+		counts = settings.segmentCounts(self)
+		ends = np.cumsum(counts)
+		first = int(self.locate(startDistance)[0])
+
+		while first < len(self):
+			# take whole segments until the block is full, a single long segment may exceed blockSize
+			startCount = ends[first] - counts[first]
+			last = int(np.searchsorted(ends, startCount + blockSize, side='right'))
+			last = max(last, first + 1)
+			block = self.sample(settings, first, last)
+			if startDistance > 0.0:
+				block = block.slice(np.searchsorted(block.distances, startDistance, side='right' if after else 'left'))
+				startDistance = 0.0
+			yield block
+			first = last
+
+
+class SampleSettings:
+	''' sampling settings for an operation
+
+	with adaptive disabled every move is sampled at stepDistance. with adaptive enabled
+	arcs are split so the chord deviation stays below chordTolerance, feed moves are
+	sampled every toolFraction * toolDiameter and rapid moves every rapidStep.
+	'''
+
+	def __init__(self, stepDistance=2.0, adaptive=False, chordTolerance=0.01, toolFraction=0.25, rapidStep=10.0):
+		self.stepDistance = stepDistance
+		self.adaptive = adaptive
+		self.chordTolerance = chordTolerance
+		self.toolFraction = toolFraction
+		self.rapidStep = rapidStep
+		self.toolDiameter = None  # set from the operations tool controller
+
+	def copy(self):
+		settings = SampleSettings(self.stepDistance, self.adaptive, self.chordTolerance, self.toolFraction, self.rapidStep)
+		settings.toolDiameter = self.toolDiameter
+		return settings
+
+	def feedStep(self):
+		''' return the sample spacing for feed moves '''
+		if self.toolDiameter:
+			return self.toolDiameter * self.toolFraction
+		return self.stepDistance
+
+	def segmentCounts(self, table, first=0, last=None):
+		''' return the number of samples for each segment of table[first:last] '''
+		lengths = table.lengths[first:last]
+		if not self.adaptive:
+			return np.ceil(lengths / self.stepDistance).astype(np.int64)
+
+		types = table.types[first:last]
+		steps = np.where(types == MOVE_RAPID, self.rapidStep, self.feedStep())
+		counts = np.ceil(lengths / steps)
+
+		arcs = types >= MOVE_CW
+		if arcs.any():
+			# largest angle whose chord stays within the tolerance of the arc
+			radii = table.radii[first:last][arcs]
+			cosHalf = np.clip(1.0 - self.chordTolerance / np.maximum(radii, 1e-9), -1.0, 1.0)
+			maxAngle = np.maximum(2.0 * np.arccos(cosHalf), 1e-6)
+			arcCounts = np.ceil(np.abs(table.sweeps[first:last][arcs]) / maxAngle)
+			counts[arcs] = np.maximum(counts[arcs], arcCounts)
+
+		return np.maximum(counts, 1).astype(np.int64)
+
+
+def segmentPoints(start, end, centre=None, clockwise=False, spacing=1.0):
+	''' return an (N, 3) array of points along a single move from start to end, including both ends
+
+	centre is the arc centre for arc moves, or None for straight moves
+	'''
+	start = np.array([start], dtype=np.float64)
+	end = np.array([end], dtype=np.float64)
+	if centre is None:
+		moveType = MOVE_FEED
+		centres = start.copy()
+	else:
+		moveType = MOVE_CW if clockwise else MOVE_CCW
+		centres = np.array([[centre[0], centre[1], start[0, 2]]], dtype=np.float64)
+
+	table = SegmentTable(start, end, centres, np.array([moveType], dtype=np.int8), np.zeros(1, dtype=np.uint16), [])
+	if not len(table):
+		return start
+	return np.concatenate((start, table.sample(spacing).positions))
+
+
+def asSampleSettings(settings):
+	''' return settings as a SampleSettings object, numbers are treated as a fixed step distance '''
+	if isinstance(settings, SampleSettings):
+		return settings
+	return SampleSettings(float(settings))
+
+
+def toolDiameter(op):
+	''' return the diameter of the operations tool or None if it isn't available '''
+	try:
+		diameter = op.ToolController.Tool.Diameter
+	except AttributeError:
+		return None
+	return float(getattr(diameter, 'Value', diameter))
+
+
+def parseMoves(commands, currentPos=(0.0, 0.0, 0.0)):
+	''' collect the motion commands as arrays of start, end, centre and move type
+
+	returns (starts, ends, centres, types, endPos) where endPos is the tool position after the last command
+	'''
+	x, y, z = currentPos
+	starts = []
+	ends = []
+	centres = []
+	types = []
+
+	for command in commands:
+		moveType = MOVE_TYPES.get(command.Name)
+		if moveType is None:
+			continue
+
+		parameters = command.Parameters
+		nx = parameters.get('X', x)
+		ny = parameters.get('Y', y)
+		nz = parameters.get('Z', z)
+		# centre offsets are relative to the start position
+		cx = x + parameters.get('I', 0.0)
+		cy = y + parameters.get('J', 0.0)
+
+		starts.append((x, y, z))
+		ends.append((nx, ny, nz))
+		centres.append((cx, cy, z))
+		types.append(moveType)
+		x, y, z = nx, ny, nz
+
+	starts = np.array(starts, dtype=np.float64).reshape(-1, 3)
+	ends = np.array(ends, dtype=np.float64).reshape(-1, 3)
+	centres = np.array(centres, dtype=np.float64).reshape(-1, 3)
+	types = np.array(types, dtype=np.int8)
+	return starts, ends, centres, types, (x, y, z)
+
+
+def parseOperation(op, currentPos=(0.0, 0.0, 0.0)):
+	''' parseMoves for the operations path, reusing the shared path cache when the gcode is unchanged '''
+	cache = PathSimCache.pathCache
+	if not hasattr(op.Path, 'toGCode'):
+		return parseMoves(op.Path.Commands, currentPos)
+
+	key = cache.key(op.Path, currentPos)
+	moves = cache.get(key)
+	if moves is None:
+		moves = parseMoves(op.Path.Commands, currentPos)
+		cache.put(key, moves)
+	return moves
+
+
+def boxesOverlap(lower, upper, radius, length, bounds):
+	''' return True where a tool of radius and length with its tip anywhere in the boxes lower, upper
+	may touch the box bounds = (xMin, yMin, zMin, xMax, yMax, zMax). the tool points down the z axis
+	'''
+	xMin, yMin, zMin, xMax, yMax, zMax = bounds
+	return ((lower[:, 2] < zMax) & (upper[:, 2] + length > zMin) &
+		(lower[:, 0] < xMax + radius) & (upper[:, 0] > xMin - radius) &
+		(lower[:, 1] < yMax + radius) & (upper[:, 1] > yMin - radius))
+
+
+def cuttingMask(positions, radius, length, bounds):
+	''' return a boolean mask of the (N, 3) tool tip positions where the tool may touch bounds
+
+	radius and length are scalars or per position arrays. positions above the stock or
+	clear of it to the side can't remove material and don't need to be cut.
+	'''
+	positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+	return boxesOverlap(positions, positions, radius, length, bounds)
+
+
+def arcSweep(starts, ends, centres, types):
+	''' return the start angle, signed sweep angle and radius for each arc move '''
+	aX = starts[:, 0] - centres[:, 0]
+	aY = starts[:, 1] - centres[:, 1]
+	bX = ends[:, 0] - centres[:, 0]
+	bY = ends[:, 1] - centres[:, 1]
+
+	startAng = np.arctan2(aY, aX)
+	sweep = np.arctan2(aX * bY - aY * bX, aX * bX + aY * bY)
+	# start and end coincide: full circle
+	sweep = np.where(np.round(sweep, 2) == 0.0, 2 * math.pi, sweep)
+	sweep = np.where(types == MOVE_CW, -np.abs(sweep), np.abs(sweep))
+	radius = np.hypot(aX, aY)
+	return startAng, sweep, radius
+
+
+def moveLengths(starts, ends, centres, types):
+	''' return the path length of each move '''
+	lengths = np.linalg.norm(ends - starts, axis=1)
+	arcs = types >= MOVE_CW
+	if arcs.any():
+		_, sweep, radius = arcSweep(starts[arcs], ends[arcs], centres[arcs], types[arcs])
+		lengths[arcs] = np.hypot(np.abs(sweep) * radius, ends[arcs, 2] - starts[arcs, 2])
+	return lengths
+
+
+# record layout of the memory mapped path store
+POINT_DTYPE = np.dtype([
+	('position', '<f8', (3,)),
+	('distance', '<f8'),
+	('op', '<u2'),
+	('move', '<u1'),
+	('segment', '<u4'),
+])
+
+
+class PathStore:
+	''' expanded path points held in memory mapped structured array files
+
+	each record holds the position, path distance, operation index, move type and segment
+	index of a point. resident memory stays flat whatever the job size, the os pages the
+	files in and out as required. the store grows by mapping another chunk file rather than
+	resizing a mapped one, so arrays returned by points() stay valid. the chunks are
+	temporary files the os removes once they are closed, by close() or on exit.
+	'''
+
+	def __init__(self, capacity=65536):
+		self.files = []
+		self.chunks = []  # memory mapped record arrays, each filled before the next is added
+		self.starts = []  # index of the first record in each chunk
+		self.capacity = 0
+		self.count = 0
+		self.complete = False  # True once the whole path has been stored
+		self.addChunk(capacity)
+
+	def __len__(self):
+		return self.count
+
+	@property
+	def endDistance(self):
+		''' path distance of the last stored point '''
+		if not self.count:
+			return 0.0
+		return float(self.records(self.count - 1, self.count)['distance'][0])
+
+	def addChunk(self, capacity):
+		f = tempfile.TemporaryFile(prefix="pathsim_", suffix=".path")
+		self.files.append(f)
+		self.chunks.append(np.memmap(f, dtype=POINT_DTYPE, mode='w+', shape=(capacity,)))
+		self.starts.append(self.capacity)
+		self.capacity += capacity
+
+	def append(self, block):
+		''' append a PathPoints block sampled from a SegmentTable '''
+		n = len(block)
+		fields = {
+			'position': block.positions,
+			'distance': block.distances,
+			'op': block.opIndex,
+			'move': block.segments.types[block.segIdx],
+			'segment': block.segIdx,
+		}
+		done = 0
+		while done < n:
+			if self.count == self.capacity:
+				self.addChunk(max(self.capacity, n - done))
+			offset = self.count - self.starts[-1]
+			take = min(n - done, len(self.chunks[-1]) - offset)
+			records = self.chunks[-1][offset:offset + take]
+			for name, values in fields.items():
+				records[name] = values[done:done + take]
+			self.count += take
+			done += take
+
+	def records(self, start, stop):
+		''' return the records [start:stop], a view of the map when they are in one chunk '''
+		stop = min(stop, self.count)
+		parts = []
+		for chunkStart, chunk in zip(self.starts, self.chunks):
+			lo = max(start - chunkStart, 0)
+			hi = min(stop - chunkStart, len(chunk))
+			if hi > lo:
+				parts.append(chunk[lo:hi])
+		if len(parts) == 1:
+			return parts[0]
+		if not parts:
+			return self.chunks[0][:0]
+		return np.concatenate(parts)
+
+	def indexAt(self, distance):
+		''' return the index of the first stored point at or beyond distance '''
+		for chunkStart, chunk in zip(self.starts, self.chunks):
+			n = min(len(chunk), self.count - chunkStart)
+			if n <= 0:
+				break
+			idx = int(np.searchsorted(chunk['distance'][:n], distance))
+			if idx < n:
+				return chunkStart + idx
+		return self.count
+
+	def points(self, start, stop, operations, tables):
+		''' return PathPoints for records [start:stop], stop must not cross an operation boundary '''
+		records = self.records(start, stop)
+		table = tables[records['op'][0]] if len(records) else None
+		return PathPoints(records['position'], records['op'], operations, records['distance'], table, records['segment'])
+
+	def close(self):
+		''' release the maps, the files are deleted once no arrays from points() remain '''
+		self.chunks = []
+		for f in self.files:
+			f.close()
+		self.files = []
+
+
+def estimateLength(operations):
+	''' cheap estimate of the total path length, used for progress before the path is expanded '''
+	total = 0.0
+	for op in operations:
+		length = getattr(op.Path, 'Length', None)
+		if length is None:
+			starts, ends, centres, types, _ = parseMoves(op.Path.Commands)
+			length = moveLengths(starts, ends, centres, types).sum()
+		total += length
+	return total
+
+
+class PathStream:
+	''' bounded producer expanding the path one operation block at a time
+
+	blocks are produced on a background thread in to a queue holding at most bufferSize
+	PathPoints blocks, so memory use is bounded by the buffer rather than the job size.
+	the compiled segment tables are kept, restarting from a new distance only re-samples.
+	'''
+
+	def __init__(self, operations, stepDistance, bufferSize=4, blockSize=10000, settings=None, store=None):
+		self.operations = list(operations)
+		self.stepDistance = stepDistance
+		self.settings = settings or {}  # operation name: SampleSettings
+		self.bufferSize = bufferSize
+		self.blockSize = blockSize
+		self.totalLength = estimateLength(self.operations)
+		self.tables = []  # compiled segment table per operation
+		self.store = store  # optional PathStore recording the expanded path for seeking
+		self._queue = None
+		self._thread = None
+		self._stop = threading.Event()
+
+	def table(self, idx):
+		''' return the compiled segment table for the operation at idx, compiling as required '''
+		while len(self.tables) <= idx:
+			opIdx = len(self.tables)
+			if self.tables:
+				previous = self.tables[-1]
+				currentPos, startOffset = previous.endPos, previous.totalLength
+			else:
+				currentPos, startOffset = (0.0, 0.0, 0.0), 0.0
+			op = self.operations[opIdx]
+			starts, ends, centres, types, endPos = parseOperation(op, currentPos)
+			opIndex = np.full(len(types), opIdx, dtype=np.uint16)
+			table = SegmentTable(starts, ends, centres, types, opIndex, self.operations, startOffset)
+			table.endPos = endPos
+			self.tables.append(table)
+		return self.tables[idx]
+
+	def sampleSettings(self, idx):
+		''' return the sample settings for the operation at idx '''
+		op = self.operations[idx]
+		settings = self.settings.get(op.Name)
+		if settings is None:
+			settings = SampleSettings(self.stepDistance)
+		settings = settings.copy()
+		settings.toolDiameter = toolDiameter(op)
+		return settings
+
+	def blocks(self, startDistance=0.0):
+		''' generator yielding PathPoints blocks from startDistance to the end of the path '''
+		after = False
+		# the store only holds a contiguous prefix of the path
+		recording = self.store is not None and startDistance <= 0.0
+		if self.store is not None and len(self.store):
+			for block in self.storedBlocks(startDistance):
+				yield block
+			if self.store.complete:
+				return
+			recording = self.store.endDistance >= startDistance
+			if recording:
+				# continue sampling after the last stored point
+				startDistance = self.store.endDistance
+				after = True
+
+		for idx in range(len(self.operations)):
+			table = self.table(idx)
+			if table.totalLength < startDistance or (after and table.totalLength == startDistance):
+				continue
+			settings = self.sampleSettings(idx)
+			for block in table.sampleBlocks(settings, self.blockSize, startDistance, after):
+				if recording and len(block):
+					self.store.append(block)
+				yield block
+			after = False
+			startDistance = 0.0
+
+		if self.tables:
+			# all operations are compiled, the length is now exact
+			self.totalLength = self.tables[-1].totalLength
+			if recording:
+				self.store.complete = True
+
+	def storedBlocks(self, startDistance):
+		''' generator reading PathPoints blocks from the store, split at operation boundaries '''
+		store = self.store
+		start = store.indexAt(startDistance)
+		while start < len(store):
+			stop = min(start + self.blockSize, len(store))
+			# stop at the first change of operation
+			ops = store.records(start, stop)['op']
+			opChange = np.flatnonzero(ops != ops[0])
+			if len(opChange):
+				stop = start + int(opChange[0])
+			yield store.points(start, stop, self.operations, self.tables)
+			start = stop
+
+	def close(self):
+		''' stop the producer and remove the store file '''
+		self.stop()
+		if self.store is not None:
+			self.store.close()
+			self.store = None
+
+	def start(self, startDistance=0.0):
+		''' start producing blocks from startDistance, any running producer is stopped '''
+		self.stop()
+		self._queue = queue.Queue(self.bufferSize)
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._produce, args=(startDistance, self._queue, self._stop))
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _produce(self, startDistance, blockQueue, stop):
+		try:
+			for block in self.blocks(startDistance):
+				if not self._put(blockQueue, stop, block):
+					return
+		except Exception as e:
+			# a failure isn't the end of the path, next raises it in the consumer
+			self._put(blockQueue, stop, e)
+			return
+		# None marks the end of the path
+		self._put(blockQueue, stop, None)
+
+	def _put(self, blockQueue, stop, item):
+		while not stop.is_set():
+			try:
+				blockQueue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def next(self):
+		''' return the next PathPoints block, or None at the end of the path
+
+		an exception raised while producing the blocks is raised here
+		'''
+		if self._queue is None:
+			return None
+		block = self._queue.get()
+		if isinstance(block, Exception):
+			raise block
+		return block
+
+	def stop(self):
+		''' stop the producer and release the buffered blocks '''
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		self._queue = None
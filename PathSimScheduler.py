@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import time
+
+
+class FrameScheduler:
+	''' decides when the simulation publishes tool poses and meshes and paces playback
+
+	poses are published at frameRate. meshes are published at an adaptive rate so that
+	getMesh takes no more than meshBudget of the wall time, based on the measured cost.
+	playback advances baseRate * speed mm of path per second, a speed of 0 runs as fast
+	as the engine allows.
+	'''
+
+	def __init__(self, frameRate=30.0, meshBudget=0.25, speed=1.0, baseRate=40.0, clock=time.perf_counter):
+		self.frameRate = frameRate
+		self.meshBudget = meshBudget
+		self.baseRate = baseRate  # mm of path per second at 1x speed
+		self.speed = speed
+		self.clock = clock
+		self.maxMeshInterval = 2.0  # longest time between mesh updates in seconds
+		self.meshCost = 0.0  # smoothed getMesh duration
+		self.lastPose = None
+		self.lastMesh = None
+		self.startTime = 0.0
+		self.startDistance = 0.0
+
+	def start(self, distance=0.0):
+		''' reset the schedule, playback continues from distance '''
+		self.startTime = self.clock()
+		self.startDistance = distance
+		self.lastPose = None
+		self.lastMesh = None
+
+	def setSpeed(self, speed, distance=None):
+		''' set the playback speed multiplier, 0 runs as fast as possible '''
+		self.speed = speed
+		if distance is not None:
+			self.startTime = self.clock()
+			self.startDistance = distance
+
+	def poseInterval(self):
+		return 1.0 / self.frameRate
+
+	def frameDistance(self):
+		''' path length covered between pose frames, inf at max speed '''
+		if not self.speed:
+			return float("inf")
+		return self.baseRate * self.speed * self.poseInterval()
+
+	def meshInterval(self):
+		''' time between mesh updates keeping getMesh within the mesh budget '''
+		interval = max(self.poseInterval(), self.meshCost / self.meshBudget)
+		return min(interval, self.maxMeshInterval)
+
+	def poseDue(self):
+		''' return True if a tool pose should be published now '''
+		now = self.clock()
+		if self.lastPose is None or now - self.lastPose >= self.poseInterval():
+			self.lastPose = now
+			return True
+		return False
+
+	def meshDue(self):
+		''' return True if a mesh should be published now '''
+		now = self.clock()
+		return self.lastMesh is None or now - self.lastMesh >= self.meshInterval()
+
+	def meshDone(self, cost):
+		''' record that a mesh was published, cost is the time getMesh took '''
+		self.lastMesh = self.clock()
+		if self.meshCost:
+			self.meshCost = 0.7 * self.meshCost + 0.3 * cost
+		else:
+			self.meshCost = cost
+
+	def meshSkipped(self):
+		''' record that a due mesh was not published, the next is due after another interval '''
+		self.lastMesh = self.clock()
+
+	def pace(self, distance):
+		''' wait until playback reaches distance, returns immediately at max speed '''
+		if not self.speed:
+			return
+		due = self.startTime + (distance - self.startDistance) / (self.baseRate * self.speed)
+		delay = due - self.clock()
+		if delay > 0:
+			time.sleep(min(delay, self.maxMeshInterval))
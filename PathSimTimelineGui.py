@@ -34,6 +34,9 @@ path_to_ui = dir + "/" + ui_name
 
 mw = FreeCADGui.getMainWindow()
 
+# playback speed multipliers, 0 runs as fast as the engine allows
+playbackSpeeds = [("0.25x", 0.25), ("0.5x", 0.5), ("1x", 1.0), ("2x", 2.0), ("5x", 5.0), ("10x", 10.0), ("Max", 0)]
+
 
 class ProgressGraphicsShape(QtGui.QGraphicsObject):
     ''' graphics item to represent the progress marker on the timeline '''
@@ -99,11 +102,13 @@ class ProgressGraphicsShape(QtGui.QGraphicsObject):
 
     def mouseReleaseEvent(self, event):
         # print("mouse release event", event)
+        super().mouseReleaseEvent(event)
         self.skipRequested.emit(event.pos().x())
         self.skipping = False
 
     def mousePressEvent(self, event):
         # print("mouse down event", event)
+        super().mousePressEvent(event)
         self.skipping = True
 
 
@@ -114,6 +119,8 @@ class timeline(QtCore.QObject):
     stopSignal = QtCore.Signal()
     progressChangedSignal = QtCore.Signal(float)
     skipRequested = QtCore.Signal(float)
+    scrubRequested = QtCore.Signal(float)
+    speedChanged = QtCore.Signal(float)
 
     def __init__(self):
         super(timeline, self).__init__()
@@ -137,6 +144,7 @@ class timeline(QtCore.QObject):
         self.playButton = self.form.playButton
         self.stopButton = self.form.stopButton
         self.progressBar = self.form.progressBar
+        self.speedCombo = self.form.speedCombo
         self.scene = QtGui.QGraphicsScene()
         self.progressBar.setScene(self.scene)
 
@@ -146,8 +154,14 @@ class timeline(QtCore.QObject):
         # self.progressMarker.progresschange.connect(self.progressUpdate)
         # self.progressMarker.skipRequested.connect(self.skip)
         self.timeLine.skipRequested.connect(self.skip)
+        self.progressMarker.progresschange.connect(self.scrub)
+        self.progressMarker.skipRequested.connect(self.markerReleased)
+        self.speedCombo.currentIndexChanged.connect(self.speedChange)
 
         # initialise form
+        for label, speed in playbackSpeeds:
+            self.speedCombo.addItem(label, speed)
+        self.speedCombo.setCurrentIndex(self.speedCombo.findText("1x"))
         self.initProgressBar()
         self.setPosition()
         self.setProgress(0)
@@ -216,6 +230,23 @@ class timeline(QtCore.QObject):
         progress = position / self.progressBarWidth
         self.skipRequested.emit(progress)
 
+    def scrub(self, position):
+        ''' handle the progress marker being dragged '''
+        if self.progressMarker.skipping and self.progressBarWidth:
+            self.scrubRequested.emit(position / self.progressBarWidth)
+
+    def markerReleased(self, position):
+        ''' handle the progress marker being dropped, position is relative to the marker '''
+        self.skip(self.progressMarker.pos().x())
+
+    def speedChange(self, index):
+        ''' handle playback speed changes '''
+        self.speedChanged.emit(self.speedCombo.itemData(index))
+
+    def speed(self):
+        ''' return the selected playback speed multiplier, 0 = as fast as possible '''
+        return self.speedCombo.itemData(self.speedCombo.currentIndex())
+
     def show(self):
         ''' show the player controls '''
         self.form.show()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import math
+
+import numpy as np
+
+# tool profile types
+FLAT = "flat"
+BALL = "ball"
+BULL = "bull"
+VBIT = "v"
+
+# toolbit shape names and legacy tool types mapped to profile types. slitting saws are a disc
+# on a shank that no profile fits, they are cut with the tool shape
+SHAPE_TYPES = {
+	"endmill": FLAT,
+	"ballend": BALL, "ballendmill": BALL,
+	"bullnose": BULL, "torus": BULL,
+	"v-bit": VBIT, "vbit": VBIT, "chamfer": VBIT, "chamfermill": VBIT, "engraver": VBIT, "centerdrill": VBIT, "countersink": VBIT,
+	"drill": VBIT,
+}
+
+
+def quantity(obj, name, default=None):
+	''' return the named property of obj as a float, or default if it doesn't exist '''
+	value = getattr(obj, name, None)
+	if value is None:
+		return default
+	return float(getattr(value, 'Value', value))
+
+
+class ToolProfile:
+	''' analytic rotationally symmetric tool profile, measured from the tool tip
+
+	kind is one of FLAT, BALL, BULL or VBIT. tipAngle is the included angle of a v-bit
+	in degrees and tipDiameter the diameter of a flat at its tip. analytic is False for
+	profiles approximating a custom tool shape, those should be cut using the tool shape.
+	'''
+
+	def __init__(self, kind=FLAT, diameter=5.0, length=50.0, cornerRadius=0.0, tipAngle=90.0, tipDiameter=0.0, analytic=True):
+		self.kind = kind
+		self.analytic = analytic
+		self.diameter = diameter
+		self.length = length
+		self.cornerRadius = cornerRadius
+		self.tipAngle = tipAngle
+		self.tipDiameter = tipDiameter
+
+		if self.kind == BULL and self.cornerRadius <= 0:
+			self.kind = FLAT
+		if self.kind == BALL:
+			self.cornerRadius = self.radius
+
+	def __repr__(self):
+		return "ToolProfile({}, diameter={}, length={}, cornerRadius={}, tipAngle={})".format(
+			self.kind, self.diameter, self.length, self.cornerRadius, self.tipAngle)
+
+	@property
+	def radius(self):
+		return self.diameter / 2.0
+
+	def key(self):
+		''' hashable description of the profile '''
+		return (self.kind, self.diameter, self.length, self.cornerRadius, self.tipAngle, self.tipDiameter, self.analytic)
+
+	def height(self, r):
+		''' return the height of the cutting surface above the tip at radial distance r, inf outside the tool '''
+		r = np.asarray(r, dtype=np.float64)
+		radius = self.radius
+
+		if self.kind == BALL:
+			h = radius - np.sqrt(np.maximum(radius * radius - r * r, 0.0))
+		elif self.kind == BULL:
+			rc = min(self.cornerRadius, radius)
+			d = np.maximum(r - (radius - rc), 0.0)
+			h = rc - np.sqrt(np.maximum(rc * rc - d * d, 0.0))
+		elif self.kind == VBIT:
+			halfAngle = math.radians(min(max(self.tipAngle, 1.0), 179.0)) / 2.0
+			h = np.maximum(r - self.tipDiameter / 2.0, 0.0) / math.tan(halfAngle)
+			h = np.minimum(h, self.length)
+		else:
+			h = np.zeros_like(r)
+
+		return np.where(r <= radius, h, np.inf)
+
+	def radiusAt(self, h):
+		''' return the tool radius at height h above the tip, 0 below the tip and above the tool length '''
+		h = np.asarray(h, dtype=np.float64)
+		radius = self.radius
+
+		if self.kind in (BALL, BULL):
+			rc = min(self.cornerRadius, radius)
+			d = np.clip(rc - h, 0.0, rc)
+			r = radius - rc + np.sqrt(np.maximum(rc * rc - d * d, 0.0))
+		elif self.kind == VBIT:
+			halfAngle = math.radians(min(max(self.tipAngle, 1.0), 179.0)) / 2.0
+			r = np.minimum(self.tipDiameter / 2.0 + np.maximum(h, 0.0) * math.tan(halfAngle), radius)
+		else:
+			r = np.full_like(h, radius)
+
+		return np.where((h >= 0.0) & (h <= self.length), r, 0.0)
+
+	def sweptLine(self, start, end, qx, qy):
+		''' analytic swept volume of a straight move from start to end at the query points qx, qy
+
+		returns (lower, upper) arrays: the lowest and highest z of the tool above each point
+		during the move, lower is inf where the tool doesn't pass. returns None when there is
+		no closed form for the move, only horizontal moves and flat tools are handled.
+		'''
+		sx, sy, sz = start
+		ex, ey, ez = end
+		ux = ex - sx
+		uy = ey - sy
+		wx = np.asarray(qx, dtype=np.float64) - sx
+		wy = np.asarray(qy, dtype=np.float64) - sy
+		uu = ux * ux + uy * uy
+
+		if abs(ez - sz) < 1e-9:
+			# horizontal: the lowest point is at the nearest approach to the move
+			if uu > 0:
+				t = np.clip((wx * ux + wy * uy) / uu, 0.0, 1.0)
+			else:
+				t = np.zeros_like(wx)
+			d = np.hypot(wx - t * ux, wy - t * uy)
+			lower = sz + self.height(d)
+			return lower, np.where(np.isfinite(lower), sz + self.length, -np.inf)
+
+		if self.kind != FLAT:
+			return None
+
+		# flat tool: find the range of t where the point is under the tool, z is linear in t
+		radius = self.radius
+		if uu > 1e-12:
+			b = -(wx * ux + wy * uy) / uu
+			c = (wx * wx + wy * wy - radius * radius) / uu
+			disc = b * b - c
+			root = np.sqrt(np.maximum(disc, 0.0))
+			# points on the edge of the sweep touch the tool at one t, allow for rounding there
+			inside = (disc >= -1e-9 * (1.0 + b * b)) & (-b - root <= 1.0) & (-b + root >= 0.0)
+			t0 = np.clip(-b - root, 0.0, 1.0)
+			t1 = np.clip(-b + root, 0.0, 1.0)
+		else:
+			t0 = np.zeros_like(wx)
+			t1 = np.ones_like(wx)
+			inside = wx * wx + wy * wy <= radius * radius
+
+		z0 = sz + t0 * (ez - sz)
+		z1 = sz + t1 * (ez - sz)
+		lower = np.where(inside, np.minimum(z0, z1), np.inf)
+		upper = np.where(inside, np.maximum(z0, z1) + self.length, -np.inf)
+		return lower, upper
+
+	@classmethod
+	def fromShape(cls, shape):
+		''' fallback profile from the bounding box of a tool shape '''
+		bb = shape.BoundBox
+		return cls(FLAT, max(bb.XLength, bb.YLength), bb.ZLength, analytic=False)
+
+	@classmethod
+	def fromTool(cls, tool):
+		''' build the profile from a ToolBit or legacy Path tool '''
+		shapeName = getattr(tool, 'ShapeName', None) or getattr(tool, 'ToolType', None)
+		if shapeName is None and hasattr(tool, 'BitShape'):
+			shapeName = tool.BitShape.split('/')[-1].split('.')[0]
+		kind = SHAPE_TYPES.get(str(shapeName).lower().replace(" ", ""))
+
+		diameter = quantity(tool, 'Diameter')
+		if diameter is None:
+			if hasattr(tool, 'Shape'):
+				return cls.fromShape(tool.Shape)
+			raise ValueError("Tool {} has no Diameter or Shape".format(getattr(tool, 'Label', tool)))
+
+		length = quantity(tool, 'Length') or quantity(tool, 'CuttingEdgeHeight') or diameter * 10
+		flatRadius = quantity(tool, 'FlatRadius')
+
+		# legacy tools give the corner radius, toolbits the radius of the flat bottom
+		cornerRadius = quantity(tool, 'CornerRadius')
+		if cornerRadius is None:
+			cornerRadius = max(diameter / 2.0 - flatRadius, 0.0) if kind == BULL and flatRadius is not None else 0.0
+
+		tipDiameter = 0.0
+		if kind == VBIT:
+			tipDiameter = quantity(tool, 'TipDiameter') or (flatRadius or 0.0) * 2
+
+		return cls(
+			kind or FLAT,
+			diameter,
+			length,
+			cornerRadius=cornerRadius,
+			# drill toolbits give the point angle as TipAngle
+			tipAngle=quantity(tool, 'TipAngle') or quantity(tool, 'CuttingEdgeAngle', 90.0),
+			tipDiameter=tipDiameter,
+			analytic=kind is not None)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+import numpy as np
+
+from pivy import coin
+
+import FreeCAD
+import FreeCADGui
+
+from engines import mesh_utils
+
+
+class MeshNode:
+	''' a coin separator drawing a triangle mesh from (vertices, faces) arrays, updated in place '''
+
+	def __init__(self):
+		self.root = coin.SoSeparator()
+		self.coords = coin.SoCoordinate3()
+		self.faces = coin.SoIndexedFaceSet()
+		self.root.addChild(self.coords)
+		self.root.addChild(self.faces)
+
+	def setArrays(self, vertices, faces):
+		vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+		faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+		# coin index lists end each face with -1
+		indices = np.ascontiguousarray(np.column_stack((faces, np.full(len(faces), -1, dtype=np.int32))).ravel())
+		# pivy copies numpy arrays in to the fields without going through python lists
+		self.coords.point.setNum(len(vertices))
+		self.coords.point.setValues(0, len(vertices), vertices)
+		self.faces.coordIndex.setNum(len(indices))
+		self.faces.coordIndex.setValues(0, len(indices), indices)
+
+
+class SimView:
+	''' draws the simulated stock and tool straight in to the 3d view
+
+	the nodes are added to the scene graph of the active view, no document objects are
+	created so updates don't recompute the document. the stock is drawn as a set of
+	patches, engines that mesh in tiles only replace the patches that changed.
+	'''
+
+	def __init__(self):
+		self.root = coin.SoSeparator()
+		self.view = None
+
+		hints = coin.SoShapeHints()
+		hints.vertexOrdering = coin.SoShapeHints.COUNTERCLOCKWISE
+		hints.creaseAngle = 0.5
+		self.root.addChild(hints)
+
+		self.stock = coin.SoSeparator()
+		stockMaterial = coin.SoMaterial()
+		stockMaterial.diffuseColor = (0.8, 0.8, 0.8)
+		self.stock.addChild(stockMaterial)
+		self.root.addChild(self.stock)
+		self.patches = {}  # tile: MeshNode
+
+		self.tool = coin.SoSeparator()
+		self.toolSwitch = coin.SoSwitch()
+		self.toolTransform = coin.SoTransform()
+		toolMaterial = coin.SoMaterial()
+		toolMaterial.diffuseColor = (0.9, 0.6, 0.1)
+		self.toolMesh = MeshNode()
+		self.tool.addChild(self.toolTransform)
+		self.tool.addChild(toolMaterial)
+		self.tool.addChild(self.toolMesh.root)
+		self.toolSwitch.addChild(self.tool)
+		self.toolSwitch.whichChild = coin.SO_SWITCH_NONE
+		self.root.addChild(self.toolSwitch)
+
+	def attach(self):
+		''' add the nodes to the active 3d view '''
+		if self.view is not None:
+			return
+		self.view = FreeCADGui.ActiveDocument.ActiveView
+		self.view.getSceneGraph().addChild(self.root)
+
+	def detach(self):
+		''' remove the nodes from the 3d view '''
+		if self.view is None:
+			return
+		try:
+			self.view.getSceneGraph().removeChild(self.root)
+		except RuntimeError:
+			# the view has been closed
+			pass
+		self.view = None
+
+	def setPatches(self, patches):
+		''' replace the stock patches in a dict of {tile: (vertices, faces)} '''
+		if None in self.patches and None not in patches:
+			# tiles replace the whole stock shown before the first update
+			self.stock.removeChild(self.patches.pop(None).root)
+		for tile, (vertices, faces) in patches.items():
+			node = self.patches.get(tile)
+			if node is None:
+				node = MeshNode()
+				self.patches[tile] = node
+				self.stock.addChild(node.root)
+			node.setArrays(vertices, faces)
+
+	def setStockArrays(self, vertices, faces):
+		''' show the whole stock as a single patch, updated in place '''
+		if any(tile is not None for tile in self.patches):
+			# switching from tiles to the whole stock
+			self.clearStock()
+		self.setPatches({None: (vertices, faces)})
+
+	def clearStock(self):
+		for node in self.patches.values():
+			self.stock.removeChild(node.root)
+		self.patches = {}
+
+	def setTool(self, shape):
+		''' show the tool shape, a freecad shape object '''
+		if not shape.Placement.isIdentity():
+			# the tool is positioned by the transform
+			shape = shape.copy()
+			shape.Placement = FreeCAD.Placement()
+		vertices, faces = mesh_utils.tessellationArrays(shape, 0.1)
+		self.toolMesh.setArrays(vertices, faces)
+		self.toolSwitch.whichChild = coin.SO_SWITCH_ALL
+
+	def hideTool(self):
+		self.toolSwitch.whichChild = coin.SO_SWITCH_NONE
+
+	def setToolPlacement(self, placement):
+		''' move the tool to placement, a freecad placement object '''
+		base = placement.Base
+		self.toolTransform.translation.setValue(base.x, base.y, base.z)
+		self.toolTransform.rotation.setValue(*placement.Rotation.Q)
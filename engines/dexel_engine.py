@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import numpy as np
+
+import PathSimPath
+import PathSimTool
+from engines import mesh_utils
+
+
+def subtractIntervals(starts, ends, a, b, capacity):
+	''' subtract [a, b] from each row of intervals, keeping at most capacity intervals per row
+
+	starts and ends are (N, K) arrays, empty slots hold (inf, -inf). a and b are (N,) arrays.
+	returns the new (N, capacity) starts and ends sorted by start.
+	'''
+	a = a[:, None]
+	b = b[:, None]
+	# subtracting an empty interval leaves the row unchanged
+	empty = b <= a
+	a = np.where(empty, np.inf, a)
+	b = np.where(empty, np.inf, b)
+	pieceStarts = np.concatenate((starts, np.maximum(starts, b)), axis=1)
+	pieceEnds = np.concatenate((np.minimum(ends, a), ends), axis=1)
+	return compactIntervals(pieceStarts, pieceEnds, capacity)
+
+
+def compactIntervals(starts, ends, capacity):
+	''' drop the empty intervals of each row and sort the rest by start in to capacity slots '''
+	valid = ends > starts
+	order = np.argsort(np.where(valid, starts, np.inf), axis=1, kind='stable')[:, :capacity]
+	starts = np.take_along_axis(np.where(valid, starts, np.inf), order, axis=1)
+	ends = np.take_along_axis(np.where(valid, ends, -np.inf), order, axis=1)
+	if starts.shape[1] < capacity:
+		pad = ((0, 0), (0, capacity - starts.shape[1]))
+		starts = np.pad(starts, pad, constant_values=np.inf)
+		ends = np.pad(ends, pad, constant_values=-np.inf)
+	return starts, ends
+
+
+class Engine:
+	''' dexel engine
+
+	the stock is held as a grid of vertical rays, each storing up to maxIntervals solid
+	[start, end] z intervals, so undercuts and multiple z levels are represented.
+	memory use is rows * cols * maxIntervals * 8 bytes, the cell size grows from
+	resolution to keep within maxMemory.
+	'''
+
+	def __init__(self):
+		self.resolution = 0.5  # cell size in mm
+		self.maxIntervals = 4  # intervals per ray
+		self.maxMemory = 256 * 1024 * 1024  # bytes
+		self.starts = None
+		self.ends = None
+		self.origin = (0.0, 0.0)  # centre of cell [0, 0]
+		self.cellSize = self.resolution
+		self.profile = None
+		self.tileSize = 64  # rays per side of the mesh patches
+		self.tiles = None
+		self.meshBudget = None  # most triangles in a mesh, set during playback. None for full resolution
+		self.meshedStride = 1  # stride the patches were last meshed at
+		self.batchSize = 256  # positions cut per vectorised update
+
+	def memoryEstimate(self, rows, cols):
+		''' bytes needed for a rows x cols dexel grid '''
+		return rows * cols * self.maxIntervals * 2 * np.dtype(np.float32).itemsize
+
+	def setTool(self, tool):
+		''' set the tool definition. tool is a freecad shape object'''
+		self.profile = PathSimTool.ToolProfile.fromShape(tool)
+
+	def setToolProfile(self, profile):
+		''' set the analytic tool profile, a PathSimTool.ToolProfile '''
+		self.profile = profile
+
+	def setStock(self, stock):
+		''' set the starting stock definition. stock is a freecad shape object'''
+		bb = stock.BoundBox
+		cellSize = self.resolution
+		cols = max(int(np.ceil(bb.XLength / cellSize)), 1)
+		rows = max(int(np.ceil(bb.YLength / cellSize)), 1)
+		memory = self.memoryEstimate(rows, cols)
+		if memory > self.maxMemory:
+			cellSize *= (memory / self.maxMemory) ** 0.5
+			cols = max(int(np.ceil(bb.XLength / cellSize)), 1)
+			rows = max(int(np.ceil(bb.YLength / cellSize)), 1)
+
+		self.cellSize = cellSize
+		self.origin = (bb.XMin + cellSize / 2.0, bb.YMin + cellSize / 2.0)
+		shape = (rows, cols, self.maxIntervals)
+		self.starts = np.full(shape, np.inf, dtype=np.float32)
+		self.ends = np.full(shape, -np.inf, dtype=np.float32)
+		self.starts[:, :, 0] = bb.ZMin
+		self.ends[:, :, 0] = bb.ZMax
+		self.tiles = mesh_utils.DirtyTiles(rows, cols, self.tileSize)
+		print("dexel_engine: {} x {} rays, {:.1f} MB".format(rows, cols, self.memoryEstimate(rows, cols) / 1048576.0))
+
+	def snapshot(self):
+		''' return a copy of the engine state for restore '''
+		return (self.starts.copy(), self.ends.copy())
+
+	def restore(self, state):
+		''' return the stock to a state from snapshot '''
+		self.starts = state[0].copy()
+		self.ends = state[1].copy()
+		self.tiles.markAll()
+
+	def meshStride(self):
+		''' return the rays between those meshed that keeps the mesh within meshBudget triangles
+
+		a box has up to 12 triangles, about 4 per ray once the shared walls are removed
+		'''
+		rows, cols = self.starts.shape[:2]
+		stride = 1
+		while self.meshBudget and stride < self.tileSize and 4 * (rows // stride) * (cols // stride) > self.meshBudget:
+			stride *= 2
+		return stride
+
+	def dirtyTiles(self):
+		''' return the tiles changed since the last call, every tile when the mesh resolution changes '''
+		stride = self.meshStride()
+		if stride != self.meshedStride:
+			self.meshedStride = stride
+			self.tiles.markAll()
+		return self.tiles.take()
+
+	def snapshotTiles(self, tiles):
+		''' return a copy of the rays meshPatches reads for tiles, so they can be meshed while cutting continues
+
+		the walls of a tile need the rays next to it, at the mesh stride
+		'''
+		stride = self.meshedStride
+		rows, cols = self.starts.shape[:2]
+		windows = {}
+		for tile in tiles:
+			r0, r1, c0, c1 = self.tiles.window(tile)
+			r0, r1 = max(r0 - stride, 0), min(r1 + stride, rows)
+			c0, c1 = max(c0 - stride, 0), min(c1 + stride, cols)
+			windows[tile] = ((r0, c0), (self.starts[r0:r1, c0:c1].copy(), self.ends[r0:r1, c0:c1].copy()))
+		return (stride, windows)
+
+	def meshPatches(self, tiles, state=None):
+		''' return {tile: (vertices, faces)} meshes of tiles for the current stock or a state from snapshotTiles '''
+		if state is None:
+			return dict((tile, self.meshArrays(None, self.tiles.window(tile), self.meshedStride)) for tile in tiles)
+		stride, windows = state
+		patches = {}
+		for tile in tiles:
+			start, rays = windows[tile]
+			patches[tile] = self.meshArrays(rays, self.tiles.window(tile), stride, start, self.starts.shape[:2])
+		return patches
+
+	def processPosition(self, placement):
+		''' process the new tool position. placement is a freecad placement object'''
+		base = placement.Base
+		self.processPositions(np.array([[base.x, base.y, base.z]]))
+
+	def processPositions(self, positions):
+		''' cut the tool at each row of an (N, 3) array of tool tip positions '''
+		for start in range(0, len(positions), self.batchSize):
+			self.cutBatch(positions[start:start + self.batchSize])
+
+	def processSegment(self, start, end, centre=None, clockwise=False):
+		''' remove the volume swept by the tool moving from start to end, both freecad placement objects
+
+		centre is the arc centre as a freecad vector for arc moves, None for straight moves
+		'''
+		s = (start.Base.x, start.Base.y, start.Base.z)
+		e = (end.Base.x, end.Base.y, end.Base.z)
+
+		if centre is None:
+			window = self.window(s, e)
+			if window is None:
+				return
+			r0, r1, c0, c1 = window
+			qx = self.origin[0] + np.arange(c0, c1) * self.cellSize
+			qy = self.origin[1] + np.arange(r0, r1) * self.cellSize
+			swept = self.profile.sweptLine(s, e, qx[None, :], qy[:, None])
+			if swept is not None:
+				self.subtract(window, swept[0], swept[1])
+				return
+
+		# no closed form, stamp the tool at cell spacing along the move
+		centre = None if centre is None else (centre.x, centre.y)
+		self.processPositions(PathSimPath.segmentPoints(s, e, centre, clockwise, self.cellSize / 2.0))
+
+	def window(self, start, end):
+		''' return the (row0, row1, col0, col1) range of rays the tool can touch moving from start to end '''
+		rows, cols = self.starts.shape[:2]
+		radius = self.profile.radius
+		c0 = max(int(np.floor((min(start[0], end[0]) - radius - self.origin[0]) / self.cellSize)), 0)
+		c1 = min(int(np.ceil((max(start[0], end[0]) + radius - self.origin[0]) / self.cellSize)) + 1, cols)
+		r0 = max(int(np.floor((min(start[1], end[1]) - radius - self.origin[1]) / self.cellSize)), 0)
+		r1 = min(int(np.ceil((max(start[1], end[1]) + radius - self.origin[1]) / self.cellSize)) + 1, rows)
+		if c0 >= c1 or r0 >= r1:
+			return None
+		return r0, r1, c0, c1
+
+	def cutBatch(self, positions):
+		''' subtract the tool volume at a batch of positions from the rays under the tool in vectorised passes
+
+		the tool volumes over a ray that all overlap are subtracted as their union in the first pass,
+		other rays have them subtracted in position order, one per pass
+		'''
+		rows, cols = self.starts.shape[:2]
+		radius = self.profile.radius
+		span = int(np.ceil(radius / self.cellSize)) + 1
+		offsets = np.arange(-span, span + 1)
+
+		# nearest ray to each tool centre and the window of rays around it
+		col = np.rint((positions[:, 0] - self.origin[0]) / self.cellSize).astype(np.int64)
+		row = np.rint((positions[:, 1] - self.origin[1]) / self.cellSize).astype(np.int64)
+		winCols = col[:, None, None] + offsets[None, None, :]
+		winRows = row[:, None, None] + offsets[None, :, None]
+		winCols, winRows = np.broadcast_arrays(winCols, winRows)
+
+		dx = self.origin[0] + winCols * self.cellSize - positions[:, 0, None, None]
+		dy = self.origin[1] + winRows * self.cellSize - positions[:, 1, None, None]
+		lower = positions[:, 2, None, None] + self.profile.height(np.hypot(dx, dy))
+		upper = np.broadcast_to(positions[:, 2, None, None] + self.profile.length, lower.shape)
+
+		inside = (winCols >= 0) & (winCols < cols) & (winRows >= 0) & (winRows < rows) & np.isfinite(lower)
+		if not inside.any():
+			return
+
+		# group the hits by ray keeping position order
+		ray = (winRows * cols + winCols)[inside]
+		order = np.argsort(ray, kind='stable')
+		ray = ray[order]
+		lower = lower[inside][order]
+		upper = upper[inside][order]
+
+		# replace the hits on a ray by their union where they all overlap
+		firstHit = np.concatenate(([True], ray[1:] != ray[:-1]))
+		group = np.cumsum(firstHit) - 1
+		first = np.flatnonzero(firstHit)
+		overlap = np.maximum.reduceat(lower, first) <= np.minimum.reduceat(upper, first)
+		single = overlap[group]
+		lower = np.where(single, np.minimum.reduceat(lower, first)[group], lower)
+		upper = np.where(single, np.maximum.reduceat(upper, first)[group], upper)
+		keep = firstHit | ~single
+		ray = ray[keep]
+		lower = lower[keep]
+		upper = upper[keep]
+
+		# the n-th hit on each ray goes in pass n
+		layer = np.arange(len(ray)) - np.searchsorted(ray, ray)
+		byLayer = np.argsort(layer, kind='stable')
+		bounds = np.cumsum(np.bincount(layer))
+		cutRows, cutCols = np.divmod(ray, cols)
+		for first, last in zip(np.concatenate(([0], bounds[:-1])), bounds):
+			hits = byLayer[first:last]
+			r = cutRows[hits]
+			c = cutCols[hits]
+			newStarts, newEnds = subtractIntervals(self.starts[r, c], self.ends[r, c], lower[hits], upper[hits], self.maxIntervals)
+			self.starts[r, c] = newStarts
+			self.ends[r, c] = newEnds
+		self.tiles.mark(cutRows.min(), cutRows.max() + 1, cutCols.min(), cutCols.max() + 1)
+
+	def subtract(self, window, lower, upper):
+		''' subtract [lower, upper] from each ray in window where lower is finite '''
+		hit = np.isfinite(lower)
+		if not hit.any():
+			return
+
+		r0, r1, c0, c1 = window
+		starts = self.starts[r0:r1, c0:c1]
+		ends = self.ends[r0:r1, c0:c1]
+		newStarts, newEnds = subtractIntervals(starts[hit], ends[hit], lower[hit], upper[hit], self.maxIntervals)
+		starts[hit] = newStarts
+		ends[hit] = newEnds
+		self.tiles.mark(r0, r1, c0, c1)
+
+	def getMesh(self):
+		''' return the cut shape as a freecad Mesh object'''
+		return mesh_utils.meshFromArrays(*self.meshArrays())
+
+	def getArrays(self):
+		''' return the cut shape as (vertices, faces) arrays '''
+		return self.meshArrays(stride=self.meshStride())
+
+	def snapshotArrays(self, state):
+		''' return the (vertices, faces) of a state from snapshot, safe to call from another thread while cutting '''
+		return self.meshArrays(state, stride=self.meshStride())
+
+	def meshArrays(self, state=None, window=None, stride=1, start=(0, 0), shape=None):
+		''' return (vertices, faces) for the dexel grid, or a state from snapshot, as boxes with shared walls removed
+
+		window limits the mesh to the (row0, row1, col0, col1) rays. a stride > 1 meshes every
+		stride-th ray as a box stride cells wide, the window must start on a multiple of stride.
+		the state is the whole grid, or the rays of a grid of the given shape from cell start,
+		which start on a multiple of stride and include the rays next to the window.
+		'''
+		solidStarts, solidEnds = state if state is not None else (self.starts, self.ends)
+		cellSize = self.cellSize
+		origin = self.origin
+		gridRows, gridCols = solidStarts.shape[:2] if shape is None else shape
+		k = solidStarts.shape[2]
+		rowStart, colStart = start
+		if window is None:
+			window = (0, gridRows, 0, gridCols)
+		r0, r1, c0, c1 = window
+		if stride > 1:
+			solidStarts = solidStarts[::stride, ::stride]
+			solidEnds = solidEnds[::stride, ::stride]
+			r0, r1, c0, c1 = r0 // stride, -(-r1 // stride), c0 // stride, -(-c1 // stride)
+			gridRows, gridCols = -(-gridRows // stride), -(-gridCols // stride)
+			rowStart, colStart = rowStart // stride, colStart // stride
+			origin = (origin[0] + (stride - 1) * cellSize / 2.0, origin[1] + (stride - 1) * cellSize / 2.0)
+			cellSize *= stride
+		cols = c1 - c0
+		half = cellSize / 2.0
+		quads = []
+
+		# top and bottom of every interval
+		area = (slice(r0 - rowStart, r1 - rowStart), slice(c0 - colStart, c1 - colStart))
+		valid = solidEnds[area] > solidStarts[area]
+		rIdx, cIdx, slot = np.nonzero(valid)
+		x = origin[0] + (cIdx + c0) * cellSize
+		y = origin[1] + (rIdx + r0) * cellSize
+		quads.append(horizontalQuads(x, y, solidEnds[area][valid], half, True))
+		quads.append(horizontalQuads(x, y, solidStarts[area][valid], half, False))
+
+		# walls where a ray is solid and its neighbour isn't, the window is surrounded by its
+		# neighbouring rays and the grid border is padded with empty rays
+		pad = ((int(r0 == 0), int(r1 == gridRows)), (int(c0 == 0), int(c1 == gridCols)), (0, 0))
+		margin = (slice(max(r0 - 1, 0) - rowStart, r1 + 1 - rowStart), slice(max(c0 - 1, 0) - colStart, c1 + 1 - colStart))
+		starts = np.pad(solidStarts[margin], pad, constant_values=np.inf)
+		ends = np.pad(solidEnds[margin], pad, constant_values=-np.inf)
+		for axis in (0, 1):
+			for direction in (1, -1):
+				if axis == 1:
+					neighbourStarts = np.roll(starts, -direction, axis=1)
+					neighbourEnds = np.roll(ends, -direction, axis=1)
+				else:
+					neighbourStarts = np.roll(starts, -direction, axis=0)
+					neighbourEnds = np.roll(ends, -direction, axis=0)
+
+				wallStarts = starts[1:-1, 1:-1].reshape(-1, k)
+				wallEnds = ends[1:-1, 1:-1].reshape(-1, k)
+				nStarts = neighbourStarts[1:-1, 1:-1].reshape(-1, k)
+				nEnds = neighbourEnds[1:-1, 1:-1].reshape(-1, k)
+				for slot in range(k):
+					wallStarts, wallEnds = subtractIntervals(wallStarts, wallEnds, nStarts[:, slot], nEnds[:, slot], 2 * k)
+
+				wallValid = wallEnds > wallStarts
+				cell, _ = np.nonzero(wallValid)
+				rIdx, cIdx = np.divmod(cell, cols)
+				x = origin[0] + (cIdx + c0) * cellSize
+				y = origin[1] + (rIdx + r0) * cellSize
+				quads.append(verticalQuads(x, y, wallStarts[wallValid], wallEnds[wallValid], half, axis, direction))
+
+		corners = np.concatenate(quads)
+		vertices = corners.reshape(-1, 3)
+		quadIdx = np.arange(len(corners))[:, None] * 4
+		faces = np.concatenate((quadIdx + [0, 1, 2], quadIdx + [0, 2, 3]))
+		return vertices, faces
+
+
+def horizontalQuads(x, y, z, half, up):
+	''' (N, 4, 3) corners of cell squares at height z, counter clockwise seen from the facing side '''
+	dx = np.array([-half, half, half, -half])
+	dy = np.array([-half, -half, half, half])
+	if not up:
+		dx = dx[::-1]
+		dy = dy[::-1]
+	corners = np.empty((len(x), 4, 3))
+	corners[:, :, 0] = x[:, None] + dx
+	corners[:, :, 1] = y[:, None] + dy
+	corners[:, :, 2] = np.asarray(z, dtype=np.float64)[:, None]
+	return corners
+
+
+def verticalQuads(x, y, z0, z1, half, axis, direction):
+	''' (N, 4, 3) corners of the cell walls facing +/- x (axis 1) or +/- y (axis 0) between z0 and z1 '''
+	corners = np.empty((len(x), 4, 3))
+	z0 = np.asarray(z0, dtype=np.float64)
+	z1 = np.asarray(z1, dtype=np.float64)
+	side = np.array([-half, half, half, -half])
+	if axis == 1:
+		corners[:, :, 0] = (x + direction * half)[:, None]
+		corners[:, :, 1] = y[:, None] + side * direction
+	else:
+		corners[:, :, 0] = x[:, None] - side * direction
+		corners[:, :, 1] = (y + direction * half)[:, None]
+	corners[:, :, 2] = np.column_stack((z0, z0, z1, z1))
+	return corners
@@ -22,72 +22,201 @@
 # *                                                                         *
 # ***************************************************************************
 
-import FreeCAD
+import os
+import math
+import atexit
+import shutil
+import tempfile
+
+import numpy as np
+
 import Mesh
 
+import PathSimTool
+from engines import mesh_utils
+
 try:
 	import libcutsim
 except:
+	libcutsim = None
 	print("libcutsim not installed")
 
+_tempDir = None
+
+
+def tempDir():
+	''' per process directory for the stl output, removed on exit '''
+	global _tempDir
+	if _tempDir is None:
+		_tempDir = tempfile.mkdtemp(prefix="pathsim_libcutsim_")
+		atexit.register(shutil.rmtree, _tempDir, True)
+	return _tempDir
+
+
+def octreeSize(bb, resolution, maxMemory, nodeBytes=256, maxDepth=12):
+	''' size the octree for a stock bounding box, returns (worldSize, depth, nodes, memory)
+
+	the octree is a cube centred on the origin reaching worldSize along each axis, so it must
+	reach the furthest corner of the stock. the depth gives leaves no larger than resolution
+	unless the estimated memory is over maxMemory. nodes are estimated from the stock surface
+	area as the octree is only subdivided near the surface.
+	'''
+	reach = max(abs(bb.XMin), abs(bb.XMax), abs(bb.YMin), abs(bb.YMax), abs(bb.ZMin), abs(bb.ZMax))
+	worldSize = max(reach * 1.05, 1.0)
+	area = 2.0 * (bb.XLength * bb.YLength + bb.XLength * bb.ZLength + bb.YLength * bb.ZLength)
+
+	def estimate(depth):
+		leaf = 2.0 * worldSize / 2 ** depth
+		# the leaves on the surface plus the levels above them
+		nodes = int(area / (leaf * leaf) * 4.0 / 3.0) + 8 ** min(depth, 3)
+		return nodes, nodes * nodeBytes
+
+	depth = min(max(int(math.ceil(math.log2(2.0 * worldSize / resolution))), 3), maxDepth)
+	nodes, memory = estimate(depth)
+	while depth > 3 and memory > maxMemory:
+		depth -= 1
+		nodes, memory = estimate(depth)
+	return worldSize, depth, nodes, memory
+
+
+# implicit cutter volumes of the libcutsim bindings for each profile type: (class name, [(setter name, profile value)])
+# lengths are in mm and the cone angle is the half angle in radians
+VOLUME_TYPES = {
+	PathSimTool.FLAT: ("CylCutterVolume", [
+		("setRadius", lambda p: p.radius),
+		("setLength", lambda p: p.length)]),
+	PathSimTool.BALL: ("BallCutterVolume", [
+		("setRadius", lambda p: p.radius),
+		("setLength", lambda p: p.length)]),
+	PathSimTool.BULL: ("BullCutterVolume", [
+		("setRadius", lambda p: p.radius),
+		("setR2", lambda p: p.cornerRadius),
+		("setLength", lambda p: p.length)]),
+	PathSimTool.VBIT: ("ConeCutterVolume", [
+		("setRadius", lambda p: p.radius),
+		("setAngle", lambda p: math.radians(p.tipAngle / 2.0)),
+		("setLength", lambda p: p.length)]),
+}
+
+
+def analyticVolume(profile):
+	''' return an implicit libcutsim volume for a PathSimTool.ToolProfile, positioned by its tip with setCenter
+
+	returns None for custom profiles or when the bindings lack the volume for the profile type, the tool
+	is then cut with its mesh
+	'''
+	if not profile.analytic or profile.kind not in VOLUME_TYPES or (profile.kind == PathSimTool.VBIT and profile.tipDiameter > 0):
+		return None
+	className, setters = VOLUME_TYPES[profile.kind]
+	missing = [className] if not hasattr(libcutsim, className) else []
+	if not missing:
+		volume = getattr(libcutsim, className)()
+		missing = ["{}.{}".format(className, name) for name, value in setters + [("setCenter", None)] if not hasattr(volume, name)]
+	if missing:
+		print("libcutsim_engine: the libcutsim bindings have no {}, cutting with the tool mesh".format(", ".join(missing)))
+		return None
+
+	for name, value in setters:
+		getattr(volume, name)(float(value(profile)))
+	return volume
+
+
 class Engine:
 	def __init__(self):
 
-		self.tool = None
+		self.tool = None  # volume cut at each position
+		self.analytic = False  # True if tool is an implicit volume rather than a mesh
+		self.analyticTools = False  # use implicit volumes for standard tool shapes, off until the bindings are verified
+		self.toolShape = None
+		self.meshTool = None  # mesh volume of toolShape, built when first needed
 		self.cutShape = None
 
-		self.gl = libcutsim.GLData()    # holds GL-data for drawing
-		self.iso = libcutsim.MarchingCubes() # isosurface algorithm
+		self.gl = None
+		self.iso = None
+		self.cs = None
 		self.world_size = 100
 		self.max_tree_depth = 7
 
-		self.cs = libcutsim.Cutsim(self.world_size, self.max_tree_depth, self.gl, self.iso) # cutting simulation
-		self.cs.init(3)  # initial subdivision of octree
+		# the octree is sized from the stock and tools when the stock is set
+		self.resolution = None  # largest voxel in mm, None uses a quarter of the smallest tool radius
+		self.maxMemory = 512 * 1024 * 1024  # bytes, the depth is reduced to stay within this
+		self.toolRadius = None  # smallest tool radius in the simulated operations
+		self.report = {}
 
 
 	def setTool(self, tool):
-		
-		toolMesh = Mesh.Mesh(tool.tessellate(0.1))
-
-		toolFacets = []
-		for f in toolMesh.Facets:
-			facetOut = f.Points
-			fn = f.Normal
-			normal = (fn.x, fn.y, fn.z)
-			facetOut.insert(0, normal)
-			toolFacets.append(facetOut)
-
-		self.tool = libcutsim.MeshVolume()
-		self.tool.loadMesh(toolFacets)
-		# spherical for testing
-		# self.tool = libcutsim.SphereVolume()
-		# self.tool.setRadius(float(3.0))
 
-	def setStock(self, stock):
+		if self.toolShape is None or not self.toolShape.isSame(tool):
+			self.toolShape = tool
+			self.meshTool = None
+		self.tool = None
+		self.analytic = False
+
+	def setToolProfile(self, profile):
+		''' use an implicit volume for standard tool shapes, custom tools are cut with the tool mesh '''
+		volume = analyticVolume(profile) if self.analyticTools else None
+		if volume is not None:
+			self.tool = volume
+			self.analytic = True
+
+	def toolVolume(self):
+		''' return the volume to cut, building the tool mesh volume if there is no implicit one '''
+		if self.tool is None:
+			if self.meshTool is None:
+				vertices, faces = mesh_utils.tessellationArrays(self.toolShape, 0.1)
+				self.meshTool = libcutsim.MeshVolume()
+				self.meshTool.loadMesh(mesh_utils.facetList(vertices, faces))
+			self.tool = self.meshTool
+			self.analytic = False
+		return self.tool
+
+	def setTools(self, profiles):
+		''' set the PathSimTool.ToolProfile of every tool used, before the stock is set '''
+		radii = [profile.radius for profile in profiles if profile.radius > 0]
+		self.toolRadius = min(radii) if radii else None
 
-		stockMesh = Mesh.Mesh(stock.tessellate(0.1))
+	def setStock(self, stock):
 
-		stockFacets = []
+		if libcutsim is None:
+			raise RuntimeError("libcutsim_engine: the libcutsim python module is not installed")
+		bb = stock.BoundBox
+		resolution = self.resolution
+		if resolution is None:
+			resolution = self.toolRadius / 4.0 if self.toolRadius else max(bb.XLength, bb.YLength, bb.ZLength) / 128.0
+		self.world_size, self.max_tree_depth, nodes, memory = octreeSize(bb, resolution, self.maxMemory)
+		voxel = 2.0 * self.world_size / 2 ** self.max_tree_depth
+		self.report = {"worldSize": self.world_size, "depth": self.max_tree_depth, "voxel": voxel, "nodes": nodes, "memory": memory}
+		print("libcutsim_engine: world size {:.1f} mm, depth {}, {:.3f} mm voxels, ~{} nodes, ~{:.0f} MB".format(
+			self.world_size, self.max_tree_depth, voxel, nodes, memory / 1048576.0))
+		if voxel > resolution * 1.01:
+			print("libcutsim_engine: voxels limited to {:.3f} mm by the {:.0f} MB memory budget".format(voxel, self.maxMemory / 1048576.0))
 
-		for f in stockMesh.Facets:
-			facetOut = f.Points
-			fn = f.Normal
-			normal = (fn.x, fn.y, fn.z)
-			facetOut.insert(0, normal)
-			stockFacets.append(facetOut)
+		self.gl = libcutsim.GLData()    # holds GL-data for drawing
+		self.iso = libcutsim.MarchingCubes() # isosurface algorithm
+		self.cs = libcutsim.Cutsim(self.world_size, self.max_tree_depth, self.gl, self.iso) # cutting simulation
+		self.cs.init(min(3, self.max_tree_depth))  # initial subdivision of octree
 
+		vertices, faces = mesh_utils.tessellationArrays(stock, 0.1)
 		self.cutShape = libcutsim.MeshVolume() # a volume for adding/subtracting 
-		self.cutShape.loadMesh(stockFacets)
+		self.cutShape.loadMesh(mesh_utils.facetList(vertices, faces))
 		self.cs.sum_volume(self.cutShape)  # add volume to octree
 
 	def getMesh(self):
 		self.cs.updateGL()
-		self.gl.get_stl('/home/sandal/libcutsim.stl')
+		# the bindings only offer stl output, written to a per process directory
+		path = os.path.join(tempDir(), "libcutsim.stl")
+		self.gl.get_stl(path)
 		mesh = Mesh.Mesh()
-		mesh.read('/home/sandal/libcutsim.stl')
+		mesh.read(path)
 		return mesh
 
 	def processPosition(self, pos):
-		self.tool.setMeshCenter(pos.Base.x, pos.Base.y, pos.Base.z)
-		# self.tool.setCenter(pos.x, pos.y, pos.z + 3)
-		self.cs.diff_volume(self.tool)
+		self.processPositions(np.array([[pos.Base.x, pos.Base.y, pos.Base.z]]))
+
+	def processPositions(self, positions):
+		''' cut the tool at each row of an (N, 3) array of tool tip positions '''
+		tool = self.toolVolume()
+		place = tool.setCenter if self.analytic else tool.setMeshCenter
+		for x, y, z in positions.tolist():
+			place(x, y, z)
+			self.cs.diff_volume(tool)
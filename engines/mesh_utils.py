@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import numpy as np
+
+import PathSimCache
+
+
+def meshFromArrays(vertices, faces):
+	''' build a Mesh.Mesh from an (V, 3) vertex array and an (F, 3) array of vertex indices '''
+	# imported here so the array kernels load in worker processes without freecad
+	import Mesh
+
+	if not len(faces):
+		return Mesh.Mesh()
+	return Mesh.Mesh((np.asarray(vertices, dtype=np.float64).tolist(), np.asarray(faces, dtype=np.int64).tolist()))
+
+
+def meshArrays(mesh):
+	''' return the (vertices, faces) arrays of a Mesh.Mesh '''
+	points, facets = mesh.Topology
+	vertices = np.array([(p.x, p.y, p.z) for p in points], dtype=np.float64).reshape(-1, 3)
+	return vertices, np.array(facets, dtype=np.int64).reshape(-1, 3)
+
+
+def strideIndex(start, stop, stride):
+	''' return every stride-th index in range(start, stop), always ending with stop - 1 '''
+	idx = np.arange(start, stop, stride)
+	if idx[-1] != stop - 1:
+		idx = np.append(idx, stop - 1)
+	return idx
+
+
+def gridMesh(heights, x0, y0, cellSize, zMin, stride=1):
+	''' triangulate a heightfield sampled at cell centres as a closed mesh
+
+	heights is a (rows, cols) array, x0 and y0 the centre of cell [0, 0]. a stride > 1 uses
+	every stride-th cell for a coarser mesh with the same extents.
+	returns (vertices, faces) arrays with the top surface, side walls and a flat bottom.
+	'''
+	rowIdx = strideIndex(0, heights.shape[0], stride)
+	colIdx = strideIndex(0, heights.shape[1], stride)
+	if stride > 1:
+		heights = heights[np.ix_(rowIdx, colIdx)]
+	rows, cols = heights.shape
+	xs = x0 + colIdx * cellSize
+	ys = y0 + rowIdx * cellSize
+	gx, gy = np.meshgrid(xs, ys)
+	top = np.column_stack((gx.ravel(), gy.ravel(), heights.ravel()))
+
+	# two triangles per grid quad, counter clockwise seen from above
+	idx = np.arange(rows * cols).reshape(rows, cols)
+	a = idx[:-1, :-1].ravel()
+	b = idx[:-1, 1:].ravel()
+	c = idx[1:, 1:].ravel()
+	d = idx[1:, :-1].ravel()
+	faces = [np.column_stack((a, b, c)), np.column_stack((a, c, d))]
+
+	# walls around the boundary down to zMin, the boundary runs counter clockwise
+	boundary = np.concatenate((idx[0, :], idx[1:, -1], idx[-1, -2::-1], idx[-2:0:-1, 0]))
+	if len(boundary) < 3:
+		return top, np.concatenate(faces)
+
+	bottom = top[boundary].copy()
+	bottom[:, 2] = zMin
+	bottomIdx = len(top) + np.arange(len(boundary))
+	nextIdx = np.roll(np.arange(len(boundary)), -1)
+	faces.append(np.column_stack((boundary, bottomIdx, bottomIdx[nextIdx])))
+	faces.append(np.column_stack((boundary, bottomIdx[nextIdx], boundary[nextIdx])))
+	# fan the bottom face, facing down
+	faces.append(np.column_stack((np.full(len(boundary) - 2, bottomIdx[0]), bottomIdx[2:], bottomIdx[1:-1])))
+
+	return np.concatenate((top, bottom)), np.concatenate(faces)
+
+
+def gridPatch(heights, r0, r1, c0, c1, x0, y0, cellSize, zMin, stride=1, start=(0, 0), shape=None):
+	''' triangulate the tile of a heightfield with cells [r0:r1, c0:c1] as part of the gridMesh surface
+
+	the tile top reaches the first row and column of the next tile so neighbouring patches meet.
+	side walls are added where the tile is on the edge of the grid and the bottom is the tile area,
+	split at the wall vertices so the patches join without t-junctions. with a stride > 1 every
+	stride-th cell is used, tiles must start on a multiple of stride. heights is the whole grid,
+	or the part of a grid of the given shape that starts at cell start.
+	returns (vertices, faces) arrays.
+	'''
+	rows, cols = heights.shape if shape is None else shape
+	lastRow = r1 == rows
+	lastCol = c1 == cols
+	rowIdx = strideIndex(r0, min(r1 + 1, rows), stride)
+	colIdx = strideIndex(c0, min(c1 + 1, cols), stride)
+	tile = heights[np.ix_(rowIdx - start[0], colIdx - start[1])]
+	tileRows, tileCols = tile.shape
+	xs = x0 + colIdx * cellSize
+	ys = y0 + rowIdx * cellSize
+	gx, gy = np.meshgrid(xs, ys)
+	top = np.column_stack((gx.ravel(), gy.ravel(), tile.ravel()))
+
+	idx = np.arange(tileRows * tileCols).reshape(tileRows, tileCols)
+	a = idx[:-1, :-1].ravel()
+	b = idx[:-1, 1:].ravel()
+	c = idx[1:, 1:].ravel()
+	d = idx[1:, :-1].ravel()
+	faces = [np.column_stack((a, b, c)), np.column_stack((a, c, d))]
+	vertices = [top]
+	count = len(top)
+
+	# walls on the grid edges, each side runs counter clockwise seen from above
+	sides = []
+	if r0 == 0:
+		sides.append(idx[0, :])
+	if lastCol:
+		sides.append(idx[:, -1])
+	if lastRow:
+		sides.append(idx[-1, ::-1])
+	if c0 == 0:
+		sides.append(idx[::-1, 0])
+	for side in sides:
+		if len(side) < 2:
+			continue
+		bottom = top[side].copy()
+		bottom[:, 2] = zMin
+		bottomIdx = count + np.arange(len(side))
+		faces.append(np.column_stack((side[:-1], bottomIdx[:-1], bottomIdx[1:])))
+		faces.append(np.column_stack((side[:-1], bottomIdx[1:], side[1:])))
+		vertices.append(bottom)
+		count += len(side)
+
+	# bottom of the tile counter clockwise seen from above, with the wall vertices on the grid
+	# edges and only the corners on the edges shared with other tiles
+	south = xs[:-1] if r0 == 0 else xs[:1]
+	east = ys[:-1] if lastCol else ys[:1]
+	north = xs[:0:-1] if lastRow else xs[-1:]
+	west = ys[:0:-1] if c0 == 0 else ys[-1:]
+	outline = np.concatenate((
+		np.column_stack((south, np.full(len(south), ys[0]))),
+		np.column_stack((np.full(len(east), xs[-1]), east)),
+		np.column_stack((north, np.full(len(north), ys[-1]))),
+		np.column_stack((np.full(len(west), xs[0]), west))))
+	centre = [(xs[0] + xs[-1]) / 2.0, (ys[0] + ys[-1]) / 2.0]
+	bottom = np.column_stack((np.vstack((outline, centre)), np.full(len(outline) + 1, zMin)))
+	vertices.append(bottom)
+	# fan from the centre, facing down
+	ring = count + np.arange(len(outline))
+	faces.append(np.column_stack((np.full(len(ring), count + len(outline)), np.roll(ring, -1), ring)))
+
+	return np.concatenate(vertices), np.concatenate(faces)
+
+
+def clusterVertices(vertices, faces, cellSize):
+	''' simplify a mesh by merging the vertices in each cellSize cube to their mean
+
+	returns (vertices, faces) arrays without the faces that collapsed or became duplicates
+	'''
+	keys = np.floor(vertices / cellSize).astype(np.int64)
+	_, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	counts = np.bincount(inverse, minlength=len(first))
+	merged = np.zeros((len(first), 3))
+	np.add.at(merged, inverse, vertices)
+	merged /= counts[:, None]
+
+	faces = inverse[faces]
+	faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+	_, unique = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+	return merged, faces[np.sort(unique)]
+
+
+def decimate(vertices, faces, maxFaces):
+	''' return the mesh clustered until it has no more than maxFaces faces '''
+	if len(faces) <= maxFaces:
+		return vertices, faces
+	size = vertices.max(axis=0) - vertices.min(axis=0)
+	# a surface over the largest face of the bounding box has about 2 faces per cell
+	area = np.sort(size)[1:].prod()
+	cellSize = max(np.sqrt(2.0 * area / maxFaces), 1e-6)
+	while True:
+		clustered = clusterVertices(vertices, faces, cellSize)
+		if len(clustered[1]) <= maxFaces:
+			return clustered
+		cellSize *= 1.5
+
+
+def combinePatches(patches):
+	''' join a dict of (vertices, faces) mesh patches into a single (vertices, faces) pair '''
+	vertices = []
+	faces = []
+	count = 0
+	for patchVertices, patchFaces in patches.values():
+		vertices.append(patchVertices)
+		faces.append(patchFaces + count)
+		count += len(patchVertices)
+	if not vertices:
+		return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+	return np.concatenate(vertices), np.concatenate(faces)
+
+
+class DirtyTiles:
+	''' tracks which square tiles of a rows x cols grid have changed since they were last meshed
+
+	a tile mesh reads the rows and columns either side of it, so marking cells also marks
+	the tiles next to them that share those cells.
+	'''
+
+	def __init__(self, rows, cols, tileSize=64):
+		self.rows = rows
+		self.cols = cols
+		self.tileSize = tileSize
+		self.dirty = np.ones((-(-rows // tileSize), -(-cols // tileSize)), dtype=bool)
+
+	def mark(self, r0, r1, c0, c1):
+		''' mark the cells [r0:r1, c0:c1] as changed '''
+		size = self.tileSize
+		self.dirty[max(r0 - 1, 0) // size:r1 // size + 1, max(c0 - 1, 0) // size:c1 // size + 1] = True
+
+	def markAll(self):
+		self.dirty[:] = True
+
+	def take(self):
+		''' return the changed tiles as a list of (row, col) and mark them clean '''
+		tiles = [tuple(tile) for tile in np.argwhere(self.dirty).tolist()]
+		self.dirty[:] = False
+		return tiles
+
+	def window(self, tile):
+		''' return the (row0, row1, col0, col1) cells of tile '''
+		size = self.tileSize
+		row, col = tile
+		return row * size, min((row + 1) * size, self.rows), col * size, min((col + 1) * size, self.cols)
+
+
+def tessellationArrays(shape, tolerance=0.1):
+	''' tessellate a freecad shape through the shared cache, returns read only (vertices, faces) arrays '''
+	return PathSimCache.tessellationCache.tessellate(shape, tolerance)
+
+
+def facetNormals(vertices, faces):
+	''' return the unit normal of each face as an (F, 3) array '''
+	a = vertices[faces[:, 0]]
+	normals = np.cross(vertices[faces[:, 1]] - a, vertices[faces[:, 2]] - a)
+	lengths = np.linalg.norm(normals, axis=1)
+	return normals / np.where(lengths > 0, lengths, 1.0)[:, None]
+
+
+def facetList(vertices, faces):
+	''' return a list of [normal, p1, p2, p3] point tuples for each face, the format of libcutsim.MeshVolume.loadMesh '''
+	if not len(faces):
+		return []
+	facets = np.concatenate((facetNormals(vertices, faces)[:, None, :], vertices[faces]), axis=1)
+	points = list(map(tuple, facets.reshape(-1, 3).tolist()))
+	return [points[i:i + 4] for i in range(0, len(points), 4)]
@@ -22,8 +22,8 @@
 # *                                                                         *
 # ***************************************************************************
 
-import FreeCAD
-import Mesh
+import PathSimCache
+from engines import mesh_utils
 
 
 class Engine:
@@ -31,6 +31,8 @@ class Engine:
 
 		self.tool = None
 		self.cutShape = None
+		self.meshedShape = None  # cut shape meshedArrays was tessellated from
+		self.meshedArrays = None
 
 	def setTool(self, tool):
 		''' set the tool definition. tool is a freecad shape object'''
@@ -42,12 +44,28 @@ class Engine:
 
 	def getMesh(self):
 		''' return the cut shape as a freecad Mesh object'''
-		# print("native_engine: get mesh")
-		mesh = Mesh.Mesh(self.cutShape.tessellate(0.1))
-		return mesh
+		return mesh_utils.meshFromArrays(*self.getArrays())
+
+	def getArrays(self):
+		''' return the cut shape as (vertices, faces) arrays '''
+		# every cut makes a new shape that won't be seen again, so only the last one is kept rather
+		# than filling the shared cache
+		if self.meshedShape is not self.cutShape:
+			self.meshedArrays = PathSimCache.tessellateShape(self.cutShape, 0.1)
+			self.meshedShape = self.cutShape
+		return self.meshedArrays
+
+	def snapshot(self):
+		''' return the engine state for restore, cuts create new shapes so no copy is needed '''
+		return self.cutShape
+
+	def restore(self, state):
+		''' return the stock to a state from snapshot '''
+		self.cutShape = state
 
 	def processPosition(self, placement):
 		''' process the new tool position. placement is a freecad placement object'''
 		# print("native_engine: processPosition")
-		toolShape = FreeCAD.ActiveDocument.getObject("Tool").Shape
+		toolShape = self.tool.copy()
+		toolShape.Placement = placement
 		self.cutShape = self.cutShape.cut(toolShape)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+
+import os
+import sys
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import PathSimPath
+from engines import zmap_engine
+
+# shared heightfields attached in this worker process, by shared memory name
+attached = {}
+
+
+class CellBounds:
+	''' records the range of cells cut in a part, stands in for DirtyTiles in the workers '''
+
+	def __init__(self):
+		self.bounds = None
+
+	def mark(self, r0, r1, c0, c1):
+		if self.bounds is None:
+			self.bounds = [r0, r1, c0, c1]
+		else:
+			b = self.bounds
+			self.bounds = [min(b[0], r0), max(b[1], r1), min(b[2], c0), max(b[3], c1)]
+
+
+def attach(name, shape):
+	''' return the shared heightfield called name, attaching to it on first use '''
+	if name not in attached:
+		for old in attached.values():
+			old[0].close()
+		attached.clear()
+		shm = shared_memory.SharedMemory(name=name)
+		attached[name] = (shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+	return attached[name][1]
+
+
+def cutPart(heights, task):
+	''' cut the positions and straight moves of a task into its window of heights
+
+	returns the (row0, row1, col0, col1) cells changed in heights, or None
+	'''
+	window, origin, cellSize, zMin, profile, positions, lines = task
+	r0, r1, c0, c1 = window
+	part = zmap_engine.Engine()
+	part.heights = heights[r0:r1, c0:c1]
+	part.origin = (origin[0] + c0 * cellSize, origin[1] + r0 * cellSize)
+	part.cellSize = cellSize
+	part.zMin = zMin
+	part.profile = profile
+	part.tiles = CellBounds()
+
+	if len(positions):
+		part.processPositions(positions)
+	for line in lines.tolist():
+		start, end = tuple(line[:3]), tuple(line[3:])
+		if not part.cutLine(start, end):
+			part.processPositions(PathSimPath.segmentPoints(start, end, None, False, cellSize / 2.0))
+
+	if part.tiles.bounds is None:
+		return None
+	b = part.tiles.bounds
+	return b[0] + r0, b[1] + r0, b[2] + c0, b[3] + c0
+
+
+def cutTask(args):
+	''' pool entry point, cut a task into the shared heightfield '''
+	name, shape, task = args
+	return cutPart(attach(name, shape), task)
+
+
+def pythonExecutable():
+	''' return a python interpreter for spawned workers, inside FreeCAD sys.executable is FreeCAD itself
+
+	returns None if there is no interpreter next to FreeCAD, or in Resources/bin of a macOS bundle
+	'''
+	exe = sys.executable
+	if os.path.basename(exe).lower().startswith("python"):
+		return exe
+	folder = os.path.dirname(exe)
+	for path in (folder, os.path.join(folder, os.pardir, "Resources", "bin")):
+		for name in ("python3", "python", "python.exe"):
+			candidate = os.path.join(path, name)
+			if os.path.isfile(candidate):
+				return os.path.normpath(candidate)
+	return None
+
+
+class Engine(zmap_engine.Engine):
+	''' heightfield engine cutting in a pool of processes for 3 axis jobs
+
+	lowering a heightfield to the tool is order independent, so positions and moves are
+	buffered and routed to every part of the stock their tool footprint overlaps. the parts
+	are cut in parallel into a heightfield held in shared memory, each worker writing only
+	its own part, so the meshes read the stitched result directly.
+	'''
+
+	def __init__(self):
+		super().__init__()
+		self.processes = os.cpu_count() or 1
+		self.partSize = 256  # cells per side of the parts cut in parallel, a multiple of tileSize
+		self.flushSize = 20000  # buffered positions that trigger a parallel cut
+		self.minParallel = 2000  # fewer buffered positions than this are cut in this process
+		self.startMethod = "spawn"  # forking the multithreaded gui process can deadlock the workers
+		self.pool = None
+		self.shm = None
+		self.pending = []  # buffered (N, 3) arrays of positions
+		self.pendingCount = 0
+		self.lines = []  # buffered straight moves as (x0, y0, z0, x1, y1, z1)
+		self.report = {}
+
+	def setTool(self, tool):
+		''' set the tool definition. tool is a freecad shape object'''
+		self.flush()
+		super().setTool(tool)
+
+	def setToolProfile(self, profile):
+		''' set the analytic tool profile, a PathSimTool.ToolProfile '''
+		self.flush()
+		super().setToolProfile(profile)
+
+	def setStock(self, stock):
+		''' set the starting stock definition. stock is a freecad shape object'''
+		self.discard()
+		self.releaseMemory()
+		super().setStock(stock)
+		self.shm = shared_memory.SharedMemory(create=True, size=self.heights.nbytes)
+		heights = np.ndarray(self.heights.shape, dtype=np.float32, buffer=self.shm.buf)
+		heights[:] = self.heights
+		self.heights = heights
+		self.report = {"processes": self.processes, "parts": 0, "parallelCuts": 0, "serialCuts": 0}
+
+	def getArrays(self):
+		''' return the cut shape as (vertices, faces) arrays '''
+		self.flush()
+		return super().getArrays()
+
+	def snapshot(self):
+		''' return a copy of the engine state for restore '''
+		self.flush()
+		return super().snapshot()
+
+	def restore(self, state):
+		''' return the stock to a state from snapshot, buffered cuts are discarded '''
+		self.discard()
+		self.heights[:] = state
+		self.tiles.markAll()
+
+	def dirtyTiles(self):
+		''' return the tiles changed since the last call, every tile when the mesh resolution changes '''
+		self.flush()
+		return super().dirtyTiles()
+
+	def snapshotTiles(self, tiles):
+		''' return a copy of the cells meshPatches reads for tiles, so they can be meshed while cutting continues '''
+		self.flush()
+		return super().snapshotTiles(tiles)
+
+	def meshPatches(self, tiles, state=None):
+		''' return {tile: (vertices, faces)} meshes of tiles for the current stock or a state from snapshotTiles '''
+		if state is None:
+			self.flush()
+		return super().meshPatches(tiles, state)
+
+	def processPositions(self, positions):
+		''' buffer an (N, 3) array of tool tip positions to be cut '''
+		positions = np.asarray(positions, dtype=np.float64)
+		if not len(positions):
+			return
+		self.pending.append(positions)
+		self.pendingCount += len(positions)
+		if self.pendingCount >= self.flushSize:
+			self.flush()
+
+	def processSegment(self, start, end, centre=None, clockwise=False):
+		''' buffer the volume swept by the tool moving from start to end, both freecad placement objects
+
+		centre is the arc centre as a freecad vector for arc moves, None for straight moves
+		'''
+		s = (start.Base.x, start.Base.y, start.Base.z)
+		e = (end.Base.x, end.Base.y, end.Base.z)
+		if centre is None:
+			self.lines.append(s + e)
+			self.pendingCount += 1
+			if self.pendingCount >= self.flushSize:
+				self.flush()
+			return
+		self.processPositions(PathSimPath.segmentPoints(s, e, (centre.x, centre.y), clockwise, self.cellSize / 2.0))
+
+	def discard(self):
+		''' drop the buffered positions and moves without cutting them '''
+		self.pending = []
+		self.lines = []
+		self.pendingCount = 0
+
+	def flush(self):
+		''' cut the buffered positions and moves '''
+		if not self.pendingCount:
+			return
+		positions = np.concatenate(self.pending) if self.pending else np.zeros((0, 3))
+		lines = np.array(self.lines, dtype=np.float64).reshape(-1, 6)
+		count = self.pendingCount
+		self.discard()
+
+		if count < self.minParallel or self.processes < 2 or self.shm is None or self.startPool() is None:
+			rows, cols = self.heights.shape
+			task = ((0, rows, 0, cols), self.origin, self.cellSize, self.zMin, self.profile, positions, lines)
+			self.markCut(cutPart(self.heights, task))
+			self.report["serialCuts"] += 1
+			return
+
+		tasks = self.partTasks(positions, lines)
+		# largest parts first so the pool stays busy
+		tasks.sort(key=lambda task: len(task[5]) + len(task[6]), reverse=True)
+		args = [(self.shm.name, self.heights.shape, task) for task in tasks]
+		for cut in self.pool.imap_unordered(cutTask, args):
+			self.markCut(cut)
+		self.report["parts"] += len(tasks)
+		self.report["parallelCuts"] += 1
+
+	def markCut(self, cut):
+		if cut is not None:
+			self.tiles.mark(*cut)
+
+	def partTasks(self, positions, lines):
+		''' return a cut task for each part of the stock with the positions and moves that can reach it '''
+		radius = self.profile.radius
+		# the cells each position and move can touch, as (x, y) min and max corners
+		lo = np.concatenate((positions[:, :2], np.minimum(lines[:, :2], lines[:, 3:5]))) - radius
+		hi = np.concatenate((positions[:, :2], np.maximum(lines[:, :2], lines[:, 3:5]))) + radius
+		parts = self.route(lo, hi)
+
+		count = len(positions)
+		rows, cols = self.heights.shape
+		size = self.partSize
+		partCols = -(-cols // size)
+		tasks = []
+		for part, idx in parts:
+			row, col = divmod(part, partCols)
+			window = (row * size, min((row + 1) * size, rows), col * size, min((col + 1) * size, cols))
+			tasks.append((window, self.origin, self.cellSize, self.zMin, self.profile, positions[idx[idx < count]], lines[idx[idx >= count] - count]))
+		return tasks
+
+	def route(self, lo, hi):
+		''' spatial index of the parts: return (part, indices) of the items whose (x, y) box from lo to hi overlaps each part '''
+		rows, cols = self.heights.shape
+		size = self.partSize
+		partCols = -(-cols // size)
+
+		# range of parts under each box, clipped to the stock
+		c0 = np.floor((lo[:, 0] - self.origin[0]) / self.cellSize)
+		c1 = np.ceil((hi[:, 0] - self.origin[0]) / self.cellSize)
+		r0 = np.floor((lo[:, 1] - self.origin[1]) / self.cellSize)
+		r1 = np.ceil((hi[:, 1] - self.origin[1]) / self.cellSize)
+		onStock = (c1 >= 0) & (c0 < cols) & (r1 >= 0) & (r0 < rows)
+		pc0 = (np.clip(c0, 0, cols - 1) // size).astype(np.int64)
+		pc1 = (np.clip(c1, 0, cols - 1) // size).astype(np.int64)
+		pr0 = (np.clip(r0, 0, rows - 1) // size).astype(np.int64)
+		pr1 = (np.clip(r1, 0, rows - 1) // size).astype(np.int64)
+
+		partIds = []
+		items = []
+		if onStock.any():
+			for dr in range(int((pr1 - pr0)[onStock].max()) + 1):
+				for dc in range(int((pc1 - pc0)[onStock].max()) + 1):
+					inside = onStock & (pr0 + dr <= pr1) & (pc0 + dc <= pc1)
+					idx = np.flatnonzero(inside)
+					partIds.append((pr0[idx] + dr) * partCols + pc0[idx] + dc)
+					items.append(idx)
+		if not partIds:
+			return []
+
+		partIds = np.concatenate(partIds)
+		items = np.concatenate(items)
+		order = np.argsort(partIds, kind='stable')
+		partIds = partIds[order]
+		items = items[order]
+		starts = np.flatnonzero(np.r_[True, partIds[1:] != partIds[:-1]])
+		return [(int(partIds[s]), np.sort(part)) for s, part in zip(starts, np.split(items, starts[1:]))]
+
+	def startPool(self):
+		''' return the worker pool, starting it on first use. None if processes can't be started '''
+		if self.pool is None:
+			try:
+				context = multiprocessing.get_context(self.startMethod)
+				if context.get_start_method() != "fork":
+					executable = pythonExecutable()
+					if executable is None:
+						# workers started with the FreeCAD binary never run, so the pool would hang
+						raise OSError("no python interpreter found next to {}".format(sys.executable))
+					context.set_executable(executable)
+				self.pool = context.Pool(self.processes)
+			except (OSError, ValueError, ImportError) as e:
+				print("PathSim: parallel cutting unavailable, cutting in one process:", e)
+				self.processes = 1
+		return self.pool
+
+	def releaseMemory(self):
+		if self.shm is not None:
+			# keep the heights readable after the shared memory is gone
+			self.heights = np.array(self.heights)
+			self.shm.close()
+			self.shm.unlink()
+			self.shm = None
+
+	def close(self):
+		''' cut anything buffered then stop the workers and release the shared memory '''
+		if self.heights is not None:
+			self.flush()
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+		self.releaseMemory()
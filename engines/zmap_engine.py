@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2020 Daniel Wood <s.d.wood.82@googlemail.com>            *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import numpy as np
+
+import PathSimPath
+import PathSimTool
+from engines import mesh_utils
+
+
+class Engine:
+	''' heightfield engine for 3 axis jobs
+
+	the stock is held as a 2D float32 grid of top heights sized from the stock bounding box.
+	each tool position lowers the grid to the analytic tool profile underneath it.
+	'''
+
+	def __init__(self):
+		self.resolution = 0.25  # cell size in mm
+		self.maxCells = 4000000  # the cell size grows to keep the grid within this size
+		self.heights = None
+		self.origin = (0.0, 0.0)  # centre of cell [0, 0]
+		self.cellSize = self.resolution
+		self.zMin = 0.0
+		self.profile = None
+		self.batchSize = 256  # positions cut per vectorised update
+		self.tileSize = 64  # cells per side of the mesh patches
+		self.tiles = None
+		self.meshBudget = None  # most triangles in a mesh, set during playback. None for full resolution
+		self.meshedStride = 1  # stride the patches were last meshed at
+
+	def setTool(self, tool):
+		''' set the tool definition. tool is a freecad shape object'''
+		self.profile = PathSimTool.ToolProfile.fromShape(tool)
+
+	def setToolProfile(self, profile):
+		''' set the analytic tool profile, a PathSimTool.ToolProfile '''
+		self.profile = profile
+
+	def setStock(self, stock):
+		''' set the starting stock definition. stock is a freecad shape object'''
+		bb = stock.BoundBox
+		cellSize = self.resolution
+		cells = (bb.XLength / cellSize) * (bb.YLength / cellSize)
+		if cells > self.maxCells:
+			cellSize *= (cells / self.maxCells) ** 0.5
+
+		cols = max(int(np.ceil(bb.XLength / cellSize)), 2)
+		rows = max(int(np.ceil(bb.YLength / cellSize)), 2)
+		self.cellSize = cellSize
+		self.origin = (bb.XMin + cellSize / 2.0, bb.YMin + cellSize / 2.0)
+		self.zMin = bb.ZMin
+		self.heights = np.full((rows, cols), bb.ZMax, dtype=np.float32)
+		self.tiles = mesh_utils.DirtyTiles(rows, cols, self.tileSize)
+
+	def getMesh(self):
+		''' return the cut shape as a freecad Mesh object'''
+		return mesh_utils.meshFromArrays(*self.getArrays())
+
+	def getArrays(self):
+		''' return the cut shape as (vertices, faces) arrays '''
+		return self.snapshotArrays(self.heights)
+
+	def snapshotArrays(self, state):
+		''' return the (vertices, faces) of a state from snapshot, safe to call from another thread while cutting '''
+		return mesh_utils.gridMesh(state, self.origin[0], self.origin[1], self.cellSize, self.zMin, self.meshStride())
+
+	def snapshot(self):
+		''' return a copy of the engine state for restore '''
+		return self.heights.copy()
+
+	def restore(self, state):
+		''' return the stock to a state from snapshot '''
+		self.heights = state.copy()
+		self.tiles.markAll()
+
+	def meshStride(self):
+		''' return the cells between mesh vertices that keeps the mesh within meshBudget triangles '''
+		rows, cols = self.heights.shape
+		stride = 1
+		while self.meshBudget and stride < self.tileSize and 2 * (rows // stride) * (cols // stride) > self.meshBudget:
+			stride *= 2
+		return stride
+
+	def dirtyTiles(self):
+		''' return the tiles changed since the last call, every tile when the mesh resolution changes '''
+		stride = self.meshStride()
+		if stride != self.meshedStride:
+			self.meshedStride = stride
+			self.tiles.markAll()
+		return self.tiles.take()
+
+	def snapshotTiles(self, tiles):
+		''' return a copy of the cells meshPatches reads for tiles, so they can be meshed while cutting continues '''
+		rows, cols = self.heights.shape
+		windows = {}
+		for tile in tiles:
+			r0, r1, c0, c1 = self.tiles.window(tile)
+			windows[tile] = ((r0, c0), self.heights[r0:min(r1 + 1, rows), c0:min(c1 + 1, cols)].copy())
+		return (self.meshedStride, windows)
+
+	def meshPatches(self, tiles, state=None):
+		''' return {tile: (vertices, faces)} meshes of tiles for the current stock or a state from snapshotTiles '''
+		stride = self.meshedStride if state is None else state[0]
+		patches = {}
+		for tile in tiles:
+			r0, r1, c0, c1 = self.tiles.window(tile)
+			start, heights = ((0, 0), self.heights) if state is None else state[1][tile]
+			patches[tile] = mesh_utils.gridPatch(heights, r0, r1, c0, c1, self.origin[0], self.origin[1], self.cellSize, self.zMin,
+				stride, start, self.heights.shape)
+		return patches
+
+	def processPosition(self, placement):
+		''' process the new tool position. placement is a freecad placement object'''
+		base = placement.Base
+		self.processPositions(np.array([[base.x, base.y, base.z]]))
+
+	def processPositions(self, positions):
+		''' cut the tool at each row of an (N, 3) array of tool tip positions '''
+		for start in range(0, len(positions), self.batchSize):
+			self.cutBatch(positions[start:start + self.batchSize])
+
+	def processSegment(self, start, end, centre=None, clockwise=False):
+		''' remove the volume swept by the tool moving from start to end, both freecad placement objects
+
+		centre is the arc centre as a freecad vector for arc moves, None for straight moves
+		'''
+		s = (start.Base.x, start.Base.y, start.Base.z)
+		e = (end.Base.x, end.Base.y, end.Base.z)
+
+		if centre is None and self.cutLine(s, e):
+			return
+
+		# no closed form, stamp the tool at cell spacing along the move
+		centre = None if centre is None else (centre.x, centre.y)
+		self.processPositions(PathSimPath.segmentPoints(s, e, centre, clockwise, self.cellSize / 2.0))
+
+	def cutLine(self, start, end):
+		''' remove the volume swept by a straight move between (x, y, z) points, returns False if it has no closed form '''
+		window = self.window(start, end)
+		if window is None:
+			return True
+		r0, r1, c0, c1 = window
+		qx = self.origin[0] + np.arange(c0, c1) * self.cellSize
+		qy = self.origin[1] + np.arange(r0, r1) * self.cellSize
+		swept = self.profile.sweptLine(start, end, qx[None, :], qy[:, None])
+		if swept is None:
+			return False
+		heights = self.heights[r0:r1, c0:c1]
+		# cuts through the stock stop at its bottom so the surface stays above the mesh bottom
+		np.minimum(heights, np.maximum(swept[0], self.zMin), out=heights, casting='unsafe')
+		self.tiles.mark(r0, r1, c0, c1)
+		return True
+
+	def window(self, start, end):
+		''' return the (row0, row1, col0, col1) range of cells the tool can touch moving from start to end '''
+		rows, cols = self.heights.shape
+		radius = self.profile.radius
+		c0 = max(int(np.floor((min(start[0], end[0]) - radius - self.origin[0]) / self.cellSize)), 0)
+		c1 = min(int(np.ceil((max(start[0], end[0]) + radius - self.origin[0]) / self.cellSize)) + 1, cols)
+		r0 = max(int(np.floor((min(start[1], end[1]) - radius - self.origin[1]) / self.cellSize)), 0)
+		r1 = min(int(np.ceil((max(start[1], end[1]) + radius - self.origin[1]) / self.cellSize)) + 1, rows)
+		if c0 >= c1 or r0 >= r1:
+			return None
+		return r0, r1, c0, c1
+
+	def cutBatch(self, positions):
+		''' lower the grid to the tool surface at a batch of positions in one vectorised update '''
+		rows, cols = self.heights.shape
+		radius = self.profile.radius
+		span = int(np.ceil(radius / self.cellSize)) + 1
+		offsets = np.arange(-span, span + 1)
+
+		# nearest cell to each tool centre and the window of cells around it
+		col = np.rint((positions[:, 0] - self.origin[0]) / self.cellSize).astype(np.int64)
+		row = np.rint((positions[:, 1] - self.origin[1]) / self.cellSize).astype(np.int64)
+		winCols = col[:, None, None] + offsets[None, None, :]
+		winRows = row[:, None, None] + offsets[None, :, None]
+		winCols, winRows = np.broadcast_arrays(winCols, winRows)
+
+		dx = self.origin[0] + winCols * self.cellSize - positions[:, 0, None, None]
+		dy = self.origin[1] + winRows * self.cellSize - positions[:, 1, None, None]
+		toolZ = positions[:, 2, None, None] + self.profile.height(np.hypot(dx, dy))
+
+		inside = (winCols >= 0) & (winCols < cols) & (winRows >= 0) & (winRows < rows) & np.isfinite(toolZ)
+		if not inside.any():
+			return
+
+		cutRows = winRows[inside]
+		cutCols = winCols[inside]
+		# index by row and column so heights can be a view into a larger grid, cuts through the
+		# stock stop at its bottom so the surface stays above the mesh bottom
+		np.minimum.at(self.heights, (cutRows, cutCols), np.maximum(toolZ[inside], self.zMin).astype(np.float32))
+		self.tiles.mark(cutRows.min(), cutRows.max() + 1, cutCols.min(), cutCols.max() + 1)
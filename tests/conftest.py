@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the addon modules are imported from the repository root, as FreeCAD does from Mod/
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+	sys.path.insert(0, root)
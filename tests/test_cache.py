@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+import PathSimCache
+from engines import native_engine
+
+
+class Point:
+	def __init__(self, x, y, z):
+		self.x, self.y, self.z = x, y, z
+
+
+class Shape:
+	''' the parts of a freecad shape the tessellation cache uses '''
+
+	def __init__(self, code, brep, size=1.0):
+		self.code = code
+		self.brep = brep
+		self.size = size
+		self.tessellations = 0
+
+	def hashCode(self):
+		return self.code
+
+	def isSame(self, other):
+		return self is other
+
+	def exportBrepToString(self):
+		return self.brep
+
+	def tessellate(self, tolerance):
+		self.tessellations += 1
+		s = self.size
+		return [Point(0, 0, 0), Point(s, 0, 0), Point(0, s, 0)], [(0, 1, 2)]
+
+
+def test_lru_evicts_least_recently_used():
+	evicted = []
+	cache = PathSimCache.LRUCache(10, lambda key, value: evicted.append(key))
+	cache.put("a", 1, 4)
+	cache.put("b", 2, 4)
+	cache.get("a")
+	cache.put("c", 3, 4)
+	assert evicted == ["b"]
+	assert "a" in cache and "c" in cache
+
+
+def test_reused_hash_code_is_not_confused():
+	cache = PathSimCache.TessellationCache()
+	first = Shape(7, "first", 1.0)
+	vertices, faces = cache.tessellate(first)
+	assert vertices[1, 0] == 1.0
+
+	# a different shape reusing the hash code of a freed one
+	second = Shape(7, "second", 2.0)
+	vertices, faces = cache.tessellate(second)
+	assert vertices[1, 0] == 2.0
+
+	cache.tessellate(first)
+	assert first.tessellations == 1
+
+
+def test_native_engine_keeps_only_last_cut_shape():
+	engine = native_engine.Engine()
+	before = len(PathSimCache.tessellationCache.memory)
+	first = Shape(1, "first")
+	engine.setStock(first)
+	vertices, faces = engine.getArrays()
+	assert engine.getArrays()[0] is vertices
+	assert first.tessellations == 1
+
+	engine.restore(Shape(2, "second", 2.0))
+	assert engine.getArrays()[0][1, 0] == 2.0
+	assert len(PathSimCache.tessellationCache.memory) == before
+
+
+def test_disk_cache_is_trimmed(tmp_path):
+	cache = PathSimCache.TessellationCache(maxDiskBytes=1)
+	cache.setCacheDir(str(tmp_path))
+	cache.tessellate(Shape(1, "a"))
+	cache.tessellate(Shape(2, "b"))
+	assert len(os.listdir(str(tmp_path))) <= 1
+
+
+def test_tessellations_in_memory_by_default(tmp_path):
+	PathSimCache.setCacheDir(str(tmp_path))
+	try:
+		assert PathSimCache.tessellationCache.cacheDir is None
+		assert PathSimCache.pathCache.cacheDir == str(tmp_path)
+	finally:
+		PathSimCache.setCacheDir(None)
+
+
+def test_frame_cache_spills():
+	frames = PathSimCache.FrameCache(maxBytes=1)
+	try:
+		frames.add(0.5, np.zeros((3, 3)), np.array([[0, 1, 2]]))
+		vertices, faces = frames.get(0.7)
+		assert faces.tolist() == [[0, 1, 2]]
+		assert frames.get(0.2) is None
+	finally:
+		frames.clear()
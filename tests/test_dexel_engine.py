@@ -0,0 +1,109 @@
+import types
+
+import numpy as np
+
+import PathSimTool
+from engines import dexel_engine
+
+
+def intervals(rows, capacity=4):
+	''' build (starts, ends) arrays from lists of (start, end) per row '''
+	starts = np.full((len(rows), capacity), np.inf)
+	ends = np.full((len(rows), capacity), -np.inf)
+	for i, row in enumerate(rows):
+		for j, (s, e) in enumerate(row):
+			starts[i, j] = s
+			ends[i, j] = e
+	return starts, ends
+
+
+def rows(starts, ends):
+	return [[(s, e) for s, e in zip(rs, re) if e > s] for rs, re in zip(starts.tolist(), ends.tolist())]
+
+
+def test_subtract_splits_and_trims():
+	starts, ends = intervals([[(0, 10)], [(0, 10)], [(0, 10)], [(0, 10)]])
+	a = np.array([4.0, -1.0, 8.0, 20.0])
+	b = np.array([6.0, 3.0, 12.0, 30.0])
+	result = rows(*dexel_engine.subtractIntervals(starts, ends, a, b, 4))
+	assert result == [[(0, 4), (6, 10)], [(3, 10)], [(0, 8)], [(0, 10)]]
+
+
+def test_subtract_everything():
+	starts, ends = intervals([[(0, 10), (12, 15)]])
+	result = rows(*dexel_engine.subtractIntervals(starts, ends, np.array([-1.0]), np.array([20.0]), 4))
+	assert result == [[]]
+
+
+def test_subtract_empty_interval_leaves_row():
+	starts, ends = intervals([[(0, 10)], [(0, 10)]])
+	a = np.array([5.0, 6.0])
+	b = np.array([5.0, 2.0])
+	result = rows(*dexel_engine.subtractIntervals(starts, ends, a, b, 4))
+	assert result == [[(0, 10)], [(0, 10)]]
+
+
+def test_compact_keeps_capacity():
+	starts, ends = intervals([[(5, 6), (0, 1), (3, 4)]])
+	result = rows(*dexel_engine.compactIntervals(starts, ends, 2))
+	assert result == [[(0, 1), (3, 4)]]
+
+
+def test_snapshot_tiles_meshes_like_stock():
+	bb = types.SimpleNamespace(XMin=0.0, YMin=0.0, ZMin=0.0, XMax=75.0, YMax=60.0, ZMax=10.0, XLength=75.0, YLength=60.0, ZLength=10.0)
+	dexel = dexel_engine.Engine()
+	dexel.resolution = 0.5
+	dexel.tileSize = 32
+	dexel.setStock(types.SimpleNamespace(BoundBox=bb))
+	dexel.setToolProfile(PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0))
+	dexel.processPositions(np.array([[40.0, 30.0, 5.0], [10.0, 50.0, 3.0]]))
+	for budget in (None, 40000):
+		dexel.meshBudget = budget
+		dexel.tiles.markAll()
+		tiles = dexel.dirtyTiles()
+		state = dexel.snapshotTiles(tiles)
+		expected = dexel.meshPatches(tiles)
+		dexel.processPositions(np.array([[40.0, 30.0, 1.0]]))
+		patches = dexel.meshPatches(tiles, state)
+		for tile in tiles:
+			assert all(np.array_equal(a, b) for a, b in zip(patches[tile], expected[tile]))
+
+
+def test_cut_batch_matches_single_positions():
+	bb = types.SimpleNamespace(XMin=0.0, YMin=0.0, ZMin=0.0, XMax=30.0, YMax=30.0, ZMax=10.0, XLength=30.0, YLength=30.0, ZLength=10.0)
+	rng = np.random.default_rng(2)
+	# short tools at spread heights leave rays with separate cuts as well as overlapping ones
+	positions = np.column_stack((rng.uniform(0, 30, 300), rng.uniform(0, 30, 300), rng.uniform(-2, 9, 300)))
+	engines = []
+	for batchSize in (1, 256):
+		dexel = dexel_engine.Engine()
+		dexel.batchSize = batchSize
+		dexel.setStock(types.SimpleNamespace(BoundBox=bb))
+		dexel.setToolProfile(PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 2.0))
+		dexel.processPositions(positions)
+		engines.append(dexel)
+	assert np.array_equal(engines[0].starts, engines[1].starts)
+	assert np.array_equal(engines[0].ends, engines[1].ends)
+
+
+def test_checkpoint_replay():
+	bb = types.SimpleNamespace(XMin=0.0, YMin=0.0, ZMin=0.0, XMax=20.0, YMax=20.0, ZMax=10.0, XLength=20.0, YLength=20.0, ZLength=10.0)
+	rng = np.random.default_rng(3)
+	positions = np.column_stack((rng.uniform(0, 20, 400), rng.uniform(0, 20, 400), rng.uniform(-2, 9, 400)))
+	engines = []
+	for seek in (False, True):
+		dexel = dexel_engine.Engine()
+		dexel.setStock(types.SimpleNamespace(BoundBox=bb))
+		dexel.setToolProfile(PathSimTool.ToolProfile(PathSimTool.BALL, 4.0, 3.0))
+		if seek:
+			# seeking back to a checkpoint and replaying from it reaches the same stock
+			dexel.processPositions(positions[:150])
+			state = dexel.snapshot()
+			dexel.processPositions(positions[150:300])
+			dexel.restore(state)
+			dexel.processPositions(positions[150:])
+		else:
+			dexel.processPositions(positions)
+		engines.append(dexel)
+	assert np.array_equal(engines[0].starts, engines[1].starts)
+	assert np.array_equal(engines[0].ends, engines[1].ends)
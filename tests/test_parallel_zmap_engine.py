@@ -0,0 +1,95 @@
+import types
+
+import numpy as np
+
+import PathSimTool
+from engines import parallel_zmap_engine
+from engines import zmap_engine
+
+
+def box(xMax, yMax, zMax):
+	bb = types.SimpleNamespace(XMin=0.0, YMin=0.0, ZMin=0.0, XMax=xMax, YMax=yMax, ZMax=zMax, XLength=xMax, YLength=yMax, ZLength=zMax)
+	return types.SimpleNamespace(BoundBox=bb)
+
+
+def placement(x, y, z):
+	return types.SimpleNamespace(Base=types.SimpleNamespace(x=x, y=y, z=z))
+
+
+def cut(engine, positions, lines):
+	engine.setStock(box(100.0, 80.0, 20.0))
+	engine.setToolProfile(PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0))
+	engine.processPositions(positions)
+	for start, end in lines:
+		engine.processSegment(placement(*start), placement(*end))
+	return engine.snapshot(), set(engine.dirtyTiles())
+
+
+def test_parallel_matches_serial():
+	rng = np.random.default_rng(0)
+	positions = np.column_stack((rng.uniform(-5, 105, 3000), rng.uniform(-5, 85, 3000), rng.uniform(-5, 21, 3000)))
+	lines = [(tuple(rng.uniform(0, 80, 3)), tuple(rng.uniform(0, 80, 3))) for _ in range(50)]
+
+	serial, serialTiles = cut(zmap_engine.Engine(), positions, lines)
+
+	engine = parallel_zmap_engine.Engine()
+	engine.processes = 2
+	engine.partSize = 128
+	engine.minParallel = 100
+	try:
+		parallel, parallelTiles = cut(engine, positions, lines)
+		assert engine.report["parallelCuts"] == 1
+	finally:
+		engine.close()
+
+	assert np.array_equal(serial, parallel)
+	assert serialTiles <= parallelTiles
+	# positions below the stock cut through to its bottom and no further
+	assert parallel.min() == 0.0
+
+
+def test_restore_discards_buffered_cuts():
+	engine = parallel_zmap_engine.Engine()
+	engine.processes = 1
+	try:
+		engine.setStock(box(20.0, 20.0, 10.0))
+		engine.setToolProfile(PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 20.0))
+		state = engine.snapshot()
+		engine.processPositions(np.array([[10.0, 10.0, 5.0]]))
+		engine.restore(state)
+		assert np.array_equal(engine.snapshot(), state)
+	finally:
+		engine.close()
+
+
+def test_route_covers_tool_footprint():
+	engine = parallel_zmap_engine.Engine()
+	engine.processes = 1
+	engine.partSize = 64
+	try:
+		engine.setStock(box(40.0, 40.0, 10.0))
+		# a box crossing the corner of four parts
+		parts = engine.route(np.array([[15.0, 15.0]]), np.array([[17.0, 17.0]]))
+		assert [part for part, idx in parts] == [0, 1, 3, 4]
+	finally:
+		engine.close()
+
+
+def test_cuts_serially_without_interpreter(monkeypatch, tmp_path):
+	freecad = tmp_path / "FreeCAD"
+	freecad.write_text("")
+	monkeypatch.setattr(parallel_zmap_engine.sys, "executable", str(freecad))
+	assert parallel_zmap_engine.pythonExecutable() is None
+
+	engine = parallel_zmap_engine.Engine()
+	engine.processes = 2
+	engine.minParallel = 1
+	try:
+		engine.setStock(box(20.0, 20.0, 10.0))
+		engine.setToolProfile(PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 20.0))
+		engine.processPositions(np.array([[10.0, 10.0, 5.0]]))
+		assert engine.snapshot().min() == 5.0
+		assert engine.pool is None
+		assert engine.report["serialCuts"] == 1
+	finally:
+		engine.close()
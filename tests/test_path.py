@@ -0,0 +1,192 @@
+import math
+import types
+
+import numpy as np
+import pytest
+
+import PathSimPath
+
+
+def command(name, **parameters):
+	return types.SimpleNamespace(Name=name, Parameters={k: float(v) for k, v in parameters.items()})
+
+
+def operation(name, commands, diameter=6.0):
+	tool = types.SimpleNamespace(Diameter=diameter)
+	return types.SimpleNamespace(Name=name, Label=name, Path=types.SimpleNamespace(Commands=commands),
+		ToolController=types.SimpleNamespace(Tool=tool))
+
+
+def pocket():
+	''' two operations with rapids, feeds and an arc '''
+	first = operation("first", [
+		command("G0", X=0, Y=0, Z=10),
+		command("G1", Z=-1),
+		command("G1", X=40),
+		command("G2", X=40, Y=20, I=0, J=10),
+		command("G1", X=0),
+		command("G0", Z=10),
+	])
+	second = operation("second", [
+		command("G0", X=10, Y=10),
+		command("G1", Z=-2, X=20, Y=10),
+		command("G3", X=20, Y=10, I=5, J=0),
+		command("G0", Z=10),
+	])
+	return [first, second]
+
+
+def collect(blocks):
+	blocks = [block for block in blocks if len(block)]
+	return (np.concatenate([b.positions for b in blocks]), np.concatenate([b.distances for b in blocks]),
+		np.concatenate([b.opIndex for b in blocks]))
+
+
+def test_store_grows_in_chunks():
+	ops = pocket()
+	stream = PathSimPath.PathStream(ops, 0.5, blockSize=50, store=PathSimPath.PathStore(capacity=64))
+	try:
+		expected = collect(stream.blocks())
+		store = stream.store
+		assert store.complete
+		assert len(store.chunks) > 1
+		assert len(store) == len(expected[0])
+
+		# a view handed out before the store grows stays valid
+		early = store.points(0, 10, ops, stream.tables)
+		store.append(next(stream.tables[0].sampleBlocks(stream.sampleSettings(0), 500)))
+		assert np.array_equal(early.positions, expected[0][:10])
+
+		# points spanning two chunks
+		across = store.records(60, 70)
+		assert np.array_equal(across['position'], expected[0][60:70])
+	finally:
+		stream.close()
+
+
+def test_store_resume_matches_expansion():
+	ops = pocket()
+	reference = PathSimPath.PathStream(ops, 0.5, blockSize=50)
+	positions, distances, opIndex = collect(reference.blocks())
+
+	stream = PathSimPath.PathStream(ops, 0.5, blockSize=50, store=PathSimPath.PathStore(capacity=64))
+	try:
+		# record part of the path, then seek beyond what was recorded
+		for block in stream.blocks():
+			break
+		assert stream.store.endDistance < float(distances[len(distances) // 2])
+		middle = float(distances[len(distances) // 2])
+		resumed = collect(stream.blocks(middle))
+		start = int(np.searchsorted(distances, middle))
+		assert np.allclose(resumed[0], positions[start:])
+		assert np.array_equal(resumed[2], opIndex[start:])
+
+		# reading back from the start replays the recorded prefix then continues expanding
+		full = collect(stream.blocks(0.0))
+		assert np.allclose(full[0], positions)
+		assert np.allclose(full[1], distances)
+	finally:
+		stream.close()
+		reference.close()
+
+
+def test_store_index_at():
+	ops = pocket()
+	stream = PathSimPath.PathStream(ops, 1.0, store=PathSimPath.PathStore(capacity=16))
+	try:
+		positions, distances, _ = collect(stream.blocks())
+		store = stream.store
+		for distance in (0.0, 5.0, float(distances[40]), math.inf):
+			assert store.indexAt(distance) == int(np.searchsorted(distances, distance))
+	finally:
+		stream.close()
+
+
+def table(commands):
+	starts, ends, centres, types, _ = PathSimPath.parseMoves(commands)
+	return PathSimPath.SegmentTable(starts, ends, centres, types, np.zeros(len(types), dtype=np.uint16), [])
+
+
+def test_segment_table_lengths():
+	segments = table([
+		command("G1", X=10),
+		command("G1", X=10),  # no motion, dropped
+		command("G3", X=0, Y=20, I=-10, J=10),
+	])
+	assert len(segments) == 2
+	assert np.allclose(segments.offsets, [0.0, 10.0, 10.0 + 0.75 * math.pi * math.hypot(10, 10)])
+
+
+def test_position_at_distance():
+	segments = table([command("G1", X=10), command("G2", X=20, Y=0, I=5, J=0)])
+	quarter = 10.0 + math.pi * 5.0 / 2.0
+	positions = segments.positionAt(np.array([0.0, 5.0, 10.0, quarter, segments.totalLength, 1e9]))
+	assert np.allclose(positions, [[0, 0, 0], [5, 0, 0], [10, 0, 0], [15, 5, 0], [20, 0, 0], [20, 0, 0]])
+
+
+def test_stream_blocks_cover_path():
+	ops = pocket()
+	stream = PathSimPath.PathStream(ops, 0.5, blockSize=40)
+	positions, distances, opIndex = collect(stream.blocks())
+	assert np.all(np.diff(distances) >= 0)
+	assert set(opIndex.tolist()) == {0, 1}
+	# every move finishes exactly on its end point
+	assert np.allclose(positions[-1], [20, 10, 10])
+	assert distances[-1] == stream.totalLength
+
+	# starting part way along the path resumes at the same points
+	resumed = collect(stream.blocks(float(distances[100])))
+	assert np.allclose(resumed[0], positions[100:])
+
+
+def test_stream_producer_thread():
+	stream = PathSimPath.PathStream(pocket(), 0.5, bufferSize=2, blockSize=40)
+	stream.start()
+	blocks = []
+	block = stream.next()
+	while block is not None:
+		blocks.append(block)
+		block = stream.next()
+	stream.stop()
+	assert np.allclose(collect(blocks)[0], collect(stream.blocks())[0])
+
+
+def test_stream_producer_error_is_raised():
+	stream = PathSimPath.PathStream(pocket(), 0.5, bufferSize=2, blockSize=40)
+	produce = stream.blocks
+
+	def failing(startDistance=0.0):
+		# a cache read failing part way along the path
+		for block in produce(startDistance):
+			yield block
+			raise OSError("cache read failed")
+
+	stream.blocks = failing
+	stream.start()
+	try:
+		assert stream.next() is not None
+		# the failure must not look like the end of the path
+		with pytest.raises(OSError):
+			stream.next()
+	finally:
+		stream.stop()
+
+
+def test_segment_points_line():
+	points = PathSimPath.segmentPoints((0.0, 0.0, 0.0), (10.0, 0.0, -2.0), spacing=0.5)
+	assert np.allclose(points[0], (0.0, 0.0, 0.0))
+	assert np.allclose(points[-1], (10.0, 0.0, -2.0))
+	steps = np.linalg.norm(np.diff(points, axis=0), axis=1)
+	assert steps.max() <= 0.5 + 1e-9
+
+
+def test_segment_points_arc():
+	points = PathSimPath.segmentPoints((5.0, 0.0, 1.0), (0.0, 5.0, 1.0), (0.0, 0.0), False, 0.25)
+	assert np.allclose(points[-1], (0.0, 5.0, 1.0))
+	assert np.allclose(np.hypot(points[:, 0], points[:, 1]), 5.0)
+	assert np.all(np.diff(np.arctan2(points[:, 1], points[:, 0])) > 0)
+
+
+def test_segment_points_zero_length():
+	points = PathSimPath.segmentPoints((1.0, 2.0, 3.0), (1.0, 2.0, 3.0))
+	assert np.allclose(points, [(1.0, 2.0, 3.0)])
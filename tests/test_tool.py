@@ -0,0 +1,102 @@
+import types
+
+import numpy as np
+import pytest
+
+import PathSimTool
+
+
+def test_bullnose_toolbit_corner_from_flat_radius():
+	tool = types.SimpleNamespace(ShapeName="bullnose", Diameter=10.0, FlatRadius=3.0, Length=40.0)
+	profile = PathSimTool.ToolProfile.fromTool(tool)
+	assert profile.kind == PathSimTool.BULL
+	assert profile.cornerRadius == pytest.approx(2.0)
+	assert profile.tipDiameter == 0.0
+
+
+def test_legacy_corner_radius():
+	tool = types.SimpleNamespace(ToolType="Torus", Diameter=10.0, CornerRadius=1.5, FlatRadius=0.0, Length=40.0)
+	profile = PathSimTool.ToolProfile.fromTool(tool)
+	assert profile.kind == PathSimTool.BULL
+	assert profile.cornerRadius == pytest.approx(1.5)
+
+
+def test_chamfer_tip_from_flat_radius():
+	tool = types.SimpleNamespace(ShapeName="chamfer", Diameter=12.0, FlatRadius=0.5, CuttingEdgeAngle=60.0, Length=40.0)
+	profile = PathSimTool.ToolProfile.fromTool(tool)
+	assert profile.kind == PathSimTool.VBIT
+	assert profile.tipDiameter == pytest.approx(1.0)
+
+
+def test_unknown_shape_is_not_analytic():
+	profile = PathSimTool.ToolProfile.fromTool(types.SimpleNamespace(ShapeName="dovetail", Diameter=6.0))
+	assert profile.kind == PathSimTool.FLAT
+	assert not profile.analytic
+	assert profile.length == pytest.approx(60.0)
+
+
+def test_missing_diameter():
+	with pytest.raises(ValueError):
+		PathSimTool.ToolProfile.fromTool(types.SimpleNamespace(ShapeName="endmill", Label="T1"))
+
+
+def test_heights():
+	r = np.array([0.0, 1.0, 3.0, 3.5])
+	ball = PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0)
+	assert np.allclose(ball.height(r)[:3], [0.0, 3.0 - np.sqrt(8.0), 3.0])
+	assert np.isinf(ball.height(r)[3])
+
+	vbit = PathSimTool.ToolProfile(PathSimTool.VBIT, 6.0, 30.0, tipAngle=90.0)
+	assert np.allclose(vbit.height(r)[:3], [0.0, 1.0, 3.0])
+
+	flat = PathSimTool.ToolProfile(PathSimTool.FLAT, 6.0, 30.0)
+	assert np.allclose(flat.radiusAt(np.array([-1.0, 0.0, 10.0, 31.0])), [0.0, 3.0, 3.0, 0.0])
+
+
+def stampedLower(profile, start, end, qx, qy, count=4001):
+	''' lowest tool surface over the query points from stamping the tool densely along the move '''
+	lower = np.full(np.broadcast(qx, qy).shape, np.inf)
+	for x, y, z in np.linspace(start, end, count):
+		lower = np.minimum(lower, z + profile.height(np.hypot(qx - x, qy - y)))
+	return lower
+
+
+def test_swept_line_horizontal_ball():
+	profile = PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0)
+	qx, qy = np.meshgrid(np.linspace(-5, 15, 41), np.linspace(-5, 10, 31))
+	lower, upper = profile.sweptLine((0.0, 0.0, 2.0), (10.0, 5.0, 2.0), qx, qy)
+	expected = stampedLower(profile, (0.0, 0.0, 2.0), (10.0, 5.0, 2.0), qx, qy)
+	assert np.array_equal(np.isfinite(lower), np.isfinite(expected))
+	hit = np.isfinite(lower)
+	assert np.allclose(lower[hit], expected[hit], atol=1e-3)
+	assert np.all(upper[hit] == 32.0)
+
+
+def test_swept_line_flat_ramp():
+	profile = PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 30.0)
+	qx, qy = np.meshgrid(np.linspace(-3, 13, 33), np.linspace(-3, 3, 13))
+	lower, upper = profile.sweptLine((0.0, 0.0, 5.0), (10.0, 0.0, 1.0), qx, qy)
+	expected = stampedLower(profile, (0.0, 0.0, 5.0), (10.0, 0.0, 1.0), qx, qy)
+	hit = np.isfinite(expected)
+	assert np.allclose(lower[hit], expected[hit], atol=1e-2)
+	assert np.all(upper[hit] >= lower[hit])
+
+
+def test_swept_line_ramp_without_closed_form():
+	profile = PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0)
+	assert profile.sweptLine((0.0, 0.0, 5.0), (10.0, 0.0, 1.0), np.zeros(1), np.zeros(1)) is None
+
+
+def test_drill_tip_angle():
+	tool = types.SimpleNamespace(ShapeName="drill", Diameter=8.0, TipAngle=118.0, Length=40.0)
+	profile = PathSimTool.ToolProfile.fromTool(tool)
+	assert profile.kind == PathSimTool.VBIT
+	assert profile.tipAngle == pytest.approx(118.0)
+	assert profile.tipDiameter == 0.0
+	assert profile.analytic
+
+
+def test_slitting_saw_uses_tool_shape():
+	tool = types.SimpleNamespace(ShapeName="slittingsaw", Diameter=50.0, Length=40.0)
+	profile = PathSimTool.ToolProfile.fromTool(tool)
+	assert not profile.analytic
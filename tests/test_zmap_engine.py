@@ -0,0 +1,137 @@
+import types
+
+import numpy as np
+
+import PathSimTool
+from engines import mesh_utils, zmap_engine
+
+
+def engine(profile, size=20.0, height=10.0):
+	bb = types.SimpleNamespace(XMin=0.0, YMin=0.0, ZMin=0.0, XMax=size, YMax=size, ZMax=height, XLength=size, YLength=size, ZLength=height)
+	zmap = zmap_engine.Engine()
+	zmap.resolution = 0.5
+	zmap.setStock(types.SimpleNamespace(BoundBox=bb))
+	zmap.setToolProfile(profile)
+	return zmap
+
+
+def cellCentres(zmap):
+	rows, cols = zmap.heights.shape
+	x = zmap.origin[0] + np.arange(cols) * zmap.cellSize
+	y = zmap.origin[1] + np.arange(rows) * zmap.cellSize
+	return np.meshgrid(x, y)
+
+
+def test_cut_batch_ball():
+	profile = PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0)
+	zmap = engine(profile)
+	zmap.processPositions(np.array([[10.0, 10.0, 4.0]]))
+
+	x, y = cellCentres(zmap)
+	expected = np.minimum(10.0, 4.0 + profile.height(np.hypot(x - 10.0, y - 10.0)))
+	assert np.allclose(zmap.heights, expected)
+
+
+def test_cut_batch_order_independent():
+	profile = PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 30.0)
+	rng = np.random.default_rng(0)
+	positions = np.column_stack((rng.uniform(0, 20, 500), rng.uniform(0, 20, 500), rng.uniform(2, 11, 500)))
+
+	forward = engine(profile)
+	forward.processPositions(positions)
+	backward = engine(profile)
+	backward.processPositions(positions[::-1])
+	assert np.array_equal(forward.heights, backward.heights)
+
+
+def test_cut_line_matches_stamping():
+	profile = PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 30.0)
+	swept = engine(profile)
+	assert swept.cutLine((2.0, 3.0, 5.0), (17.0, 12.0, 5.0))
+
+	stamped = engine(profile)
+	t = np.linspace(0.0, 1.0, 2000)[:, None]
+	stamped.processPositions(np.array([2.0, 3.0, 5.0]) + t * np.array([15.0, 9.0, 0.0]))
+	# stamping only approaches the swept volume, cells either side of the edge may differ
+	assert (swept.heights <= stamped.heights).all()
+	assert np.mean(swept.heights != stamped.heights) < 0.02
+
+
+def test_through_cut_stops_at_stock_bottom():
+	zmap = engine(PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 30.0))
+	zmap.processPositions(np.array([[10.0, 10.0, -1.0]]))
+	assert zmap.cutLine((2.0, 3.0, -2.0), (17.0, 12.0, -2.0))
+	assert zmap.heights.min() == 0.0
+	vertices, faces = zmap.getArrays()
+	assert vertices[:, 2].min() == 0.0
+
+
+def test_dirty_tiles():
+	zmap = engine(PathSimTool.ToolProfile(PathSimTool.FLAT, 2.0, 30.0), size=100.0)
+	zmap.tileSize = 64
+	zmap.setStock(types.SimpleNamespace(BoundBox=types.SimpleNamespace(
+		XMin=0.0, YMin=0.0, ZMin=0.0, XMax=100.0, YMax=100.0, ZMax=10.0, XLength=100.0, YLength=100.0, ZLength=10.0)))
+	zmap.dirtyTiles()
+	zmap.processPositions(np.array([[90.0, 10.0, 5.0]]))
+	assert zmap.dirtyTiles() == [(0, 2)]
+
+
+def unmatchedEdges(vertices, faces):
+	''' count the directed edges without a matching reverse edge once vertices at the same position are merged '''
+	_, merged = np.unique(np.round(vertices, 6), axis=0, return_inverse=True)
+	faces = merged.ravel()[faces]
+	edges = np.concatenate((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]))
+	forward = set(map(tuple, edges.tolist()))
+	return sum(1 for a, b in forward if (b, a) not in forward)
+
+
+def test_patches_watertight():
+	zmap = engine(PathSimTool.ToolProfile(PathSimTool.BALL, 6.0, 30.0), size=75.0)
+	zmap.tileSize = 32
+	zmap.setStock(types.SimpleNamespace(BoundBox=types.SimpleNamespace(
+		XMin=0.0, YMin=0.0, ZMin=0.0, XMax=75.0, YMax=60.0, ZMax=10.0, XLength=75.0, YLength=60.0, ZLength=10.0)))
+	rng = np.random.default_rng(1)
+	zmap.processPositions(np.column_stack((rng.uniform(0, 75, 50), rng.uniform(0, 60, 50), rng.uniform(2, 9, 50))))
+	for budget in (None, 20000):
+		zmap.meshBudget = budget
+		zmap.tiles.markAll()
+		patches = zmap.meshPatches(zmap.dirtyTiles())
+		assert unmatchedEdges(*mesh_utils.combinePatches(patches)) == 0
+		assert unmatchedEdges(*zmap.getArrays()) == 0
+
+
+def test_snapshot_tiles_meshes_like_stock():
+	zmap = engine(PathSimTool.ToolProfile(PathSimTool.FLAT, 4.0, 30.0), size=75.0)
+	zmap.tileSize = 32
+	zmap.meshBudget = 20000
+	zmap.dirtyTiles()
+	zmap.processPositions(np.array([[40.0, 30.0, 5.0]]))
+	tiles = zmap.dirtyTiles()
+	state = zmap.snapshotTiles(tiles)
+	expected = zmap.meshPatches(tiles)
+	zmap.processPositions(np.array([[40.0, 30.0, 1.0]]))
+	patches = zmap.meshPatches(tiles, state)
+	for tile in tiles:
+		assert all(np.array_equal(a, b) for a, b in zip(patches[tile], expected[tile]))
+
+
+def test_checkpoint_replay():
+	profile = PathSimTool.ToolProfile(PathSimTool.BALL, 4.0, 30.0)
+	rng = np.random.default_rng(3)
+	positions = np.column_stack((rng.uniform(0, 20, 400), rng.uniform(0, 20, 400), rng.uniform(2, 9, 400)))
+
+	straight = engine(profile)
+	straight.processPositions(positions)
+
+	# seeking back to a checkpoint and replaying from it reaches the same stock
+	seek = engine(profile)
+	seek.processPositions(positions[:150])
+	state = seek.snapshot()
+	seek.processPositions(positions[150:300])
+	seek.restore(state)
+	seek.processPositions(positions[150:])
+	assert np.array_equal(seek.heights, straight.heights)
+	# the checkpoint isn't changed by cutting after restoring it
+	assert not np.array_equal(seek.heights, state)
+	seek.restore(state)
+	assert np.array_equal(seek.heights, state)